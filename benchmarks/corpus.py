@@ -0,0 +1,143 @@
+import random
+
+STREET_NAMES = [
+    'ashland', 'western', 'halsted', 'pulaski', 'cicero', 'kedzie',
+    'california', 'damen', 'racine', 'clark', 'state', 'wabash',
+    'michigan', 'cottage grove', 'stony island', 'jeffery', 'harlem',
+    'austin', 'central', 'laramie', 'kostner', 'central park', 'lawndale',
+    'sacramento', 'rockwell', 'oakley', 'wolcott', 'paulina', 'loomis',
+    'morgan', 'sangamon', 'peoria', 'green', 'union', 'wells', 'lasalle',
+    'dearborn', 'wentworth', 'princeton', 'wallace', 'lowe', 'emerald',
+    'foster', 'lawrence', 'montrose', 'irving park', 'addison', 'belmont',
+    'diversey', 'fullerton', 'armitage', 'north', 'division', 'chicago',
+    'grand', 'lake', 'madison', 'jackson', 'roosevelt', 'cermak',
+    'pershing', 'garfield', 'marquette', 'ogden', 'archer', 'milwaukee',
+    'elston', 'lincoln', 'broadway', 'sheridan', 'greenview', 'oglesby',
+    'woodlawn', 'kenwood', 'dorchester', 'blackstone', 'harper', 'ridge',
+    'devon', 'touhy', 'howard', 'bryn mawr', 'peterson', 'pratt',
+]
+
+ORDINAL_STREETS = ['%s%s' % (n, 'th' if 10 <= n % 100 <= 20 else 
+                             {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th'))
+                   for n in range(1, 131)]
+
+STREET_TYPES = ['ave', 'st', 'blvd', 'rd', 'dr', 'pl', 'ct', 'pkwy']
+
+DIRECTIONS = ['n', 's', 'e', 'w']
+
+EXPANSIONS = {
+    'n': 'north', 's': 'south', 'e': 'east', 'w': 'west',
+    'ave': 'avenue', 'st': 'street', 'blvd': 'boulevard', 'rd': 'road',
+    'dr': 'drive', 'pl': 'place', 'ct': 'court', 'pkwy': 'parkway',
+}
+
+ZIPCODES = ['606%02d' % i for i in range(1, 62)]
+
+# Rough bounding box of Chicago
+LATITUDES = (41.64, 42.02)
+LONGITUDES = (-87.94, -87.52)
+
+def canonicalAddresses(n_records, seed=0):
+    '''
+    Yield `n_records` distinct Chicago style canonical address rows
+    with the columns the geocoder reads from cook_county_addresses.
+    '''
+
+    rng = random.Random(seed)
+    streets = [(name, rng.choice(STREET_TYPES)) for name in STREET_NAMES]
+    streets += [(name, 'st') for name in ORDINAL_STREETS]
+
+    seen = set()
+    record_id = 0
+
+    while record_id < n_records:
+        number = rng.randint(1, 13000)
+        direction = rng.choice(DIRECTIONS)
+        street_name, street_type = rng.choice(streets)
+        zipcode = rng.choice(ZIPCODES)
+
+        street = '%s %s %s %s' % (number, direction, street_name, street_type)
+
+        # Only a few thousand numbers per street exist, units make 
+        # up the rest of the larger corpora
+        if (street, zipcode) in seen:
+            street = '%s unit %s' % (street, rng.randint(1, 999))
+            if (street, zipcode) in seen:
+                continue
+
+        seen.add((street, zipcode))
+        record_id += 1
+
+        yield {
+            'id': record_id,
+            'address_id': 'bench-%s' % record_id,
+            'complete_street_address': street.upper(),
+            'usps_place_name': 'CHICAGO',
+            'usps_state': 'IL',
+            'zipcode': zipcode,
+            'complete_address': '%s chicago il %s' % (street, zipcode),
+            'latitude': rng.uniform(*LATITUDES),
+            'longitude': rng.uniform(*LONGITUDES),
+        }
+
+def typo(word, rng):
+    if len(word) < 4:
+        return word
+
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.randrange(3)
+
+    if kind == 0:
+        return word[:i] + word[i + 1:]
+    elif kind == 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    else:
+        return word[:i] + rng.choice('aeiourstln') + word[i + 1:]
+
+def messyAddress(canonical, rng):
+    '''
+    Make a messy version of a canonical row: drop the city and zip,
+    expand abbreviations, add typos and unit numbers, change case.
+    '''
+
+    tokens = canonical['complete_street_address'].lower().split()
+
+    if rng.random() < 0.3:
+        tokens = [EXPANSIONS.get(token, token) for token in tokens]
+
+    if rng.random() < 0.3:
+        i = rng.randrange(1, len(tokens))
+        tokens[i] = typo(tokens[i], rng)
+
+    if rng.random() < 0.15 and 'unit' not in tokens:
+        tokens += [rng.choice(['apt', 'unit', '#']), str(rng.randint(1, 40))]
+
+    if rng.random() < 0.4:
+        tokens += ['chicago', 'il']
+        if rng.random() < 0.5:
+            tokens.append(canonical['zipcode'])
+
+    address = ' '.join(tokens)
+
+    if rng.random() < 0.5:
+        address = address.title()
+
+    return address
+
+def messyAddresses(n_canonical, n_records, canonical_seed=0, seed=1):
+    '''
+    Yield `n_records` (id, messy address, true canonical id) tuples 
+    for a sample of the corpus made by `canonicalAddresses(n_canonical, 
+    canonical_seed)`. The corpus is regenerated rather than held in 
+    memory so this works at any scale.
+    '''
+
+    rng = random.Random(seed)
+    n_records = min(n_records, n_canonical)
+    sampled_ids = set(rng.sample(range(1, n_canonical + 1), n_records))
+
+    messy_id = 0
+    for canonical in canonicalAddresses(n_canonical, canonical_seed):
+        if canonical['id'] in sampled_ids:
+            messy_id += 1
+            yield messy_id, messyAddress(canonical, rng), canonical['id']
@@ -0,0 +1,288 @@
+'''
+Replay real /geocode/ traffic against a running geocoder.
+
+Reads the /geocode/ requests from an access log in the Common or
+Combined Log Format (as gunicorn writes it) or as written by the
+Werkzeug server behind runserver.py, or addresses from a plain file, one per line, and
+sends them to `--url` with `--concurrency` requests in flight. Logged
+requests keep their recorded spacing, sped up by `--speed`; plain
+addresses go out at `--rate` per second, or as fast as they can.
+
+Latency is measured from when each request was due to be sent rather
+than from when a thread was free to send it, so a server that falls
+behind shows up in the tail instead of quietly slowing the replay down.
+Every request asks for debug=timings, so results are also broken down
+by how many candidates each address had:
+
+    python -m benchmarks.replay access.log --url http://localhost:5000 \
+        --speed 4 --concurrency 16
+'''
+import os
+import re
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+
+from benchmarks.run import percentiles, gitCommit
+
+LOG_LINE = re.compile(r'\[(?P<time>[^\]]+)\] "GET (?P<path>\S+) [^"]*"')
+
+# Common Log Format, then Werkzeug's, which has no time zone
+LOG_TIMES = ('%d/%b/%Y:%H:%M:%S %z', '%d/%b/%Y %H:%M:%S')
+
+# Upper bounds of the candidate count buckets
+CANDIDATE_BUCKETS = (0, 10, 50, 250, 1000)
+
+def logTime(value):
+    for log_time in LOG_TIMES:
+        try:
+            at = datetime.strptime(value, log_time)
+        except ValueError:
+            continue
+        return at.replace(tzinfo=None) - (at.utcoffset() or timedelta(0))
+
+    return None
+
+def readAccessLog(f):
+    '''
+    Yields (seconds since the first request, address) for each
+    /geocode/ request in an access log
+    '''
+
+    first = None
+
+    for line in f:
+        match = LOG_LINE.search(line)
+        if not match:
+            continue
+
+        url = urlsplit(match.group('path'))
+        if url.path.rstrip('/') != '/geocode':
+            continue
+
+        address = parse_qs(url.query).get('address')
+        if not address:
+            continue
+
+        at = logTime(match.group('time'))
+        if at is None:
+            continue
+
+        if first is None:
+            first = at
+
+        yield (at - first).total_seconds(), address[0]
+
+def readAddresses(f, rate=None):
+    '''
+    Yields (seconds from the start, address) for each line of a plain
+    file, spaced out to `rate` per second, or all due at once
+    '''
+
+    n = 0
+    for line in f:
+        address = line.strip()
+        if address:
+            yield (n / float(rate) if rate else 0.0), address
+            n += 1
+
+def isAccessLog(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                return LOG_LINE.search(line) is not None
+    return False
+
+def candidateBucket(n_candidates):
+    if n_candidates is None:
+        return 'unknown'
+
+    lower = 0
+    for upper in CANDIDATE_BUCKETS:
+        if n_candidates <= upper:
+            return str(upper) if lower == upper else '%s-%s' % (lower, upper)
+        lower = upper + 1
+
+    return '>%s' % CANDIDATE_BUCKETS[-1]
+
+def sendRequest(session, url, address, due, timeout):
+    '''
+    Returns the seconds from `due` until the response came back, whether
+    it was an error and the number of candidates it reported
+    '''
+
+    n_candidates = None
+
+    try:
+        response = session.get(url,
+                               params={'address': address, 'debug': 'timings'},
+                               timeout=timeout)
+        error = response.status_code != 200
+        if not error:
+            n_candidates = response.json().get('candidates')
+    except (requests.RequestException, ValueError):
+        error = True
+
+    return time.time() - due, error, n_candidates
+
+def summarize(results):
+    latencies = [latency for latency, _, _ in results]
+    errors = sum(1 for _, error, _ in results if error)
+
+    summary = percentiles(latencies) if latencies else OrderedDict([('requests', 0)])
+    summary['errors'] = errors
+    summary['error_rate'] = float(errors) / len(results) if results else 0.0
+
+    return summary
+
+def replay(requests_to_send,
+           url='http://localhost:5000',
+           speed=1.0,
+           concurrency=8,
+           timeout=30):
+    '''
+    Send each (offset in seconds, address) at its offset divided by
+    `speed` and report on the responses
+    '''
+
+    # Access logs are written as requests finish, so can be a little
+    # out of order
+    requests_to_send = sorted(requests_to_send, key=lambda r: r[0])
+
+    geocode_url = '%s/geocode/' % url.rstrip('/')
+
+    local = threading.local()
+
+    def send(address, due):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        return sendRequest(session, geocode_url, address, due, timeout)
+
+    futures = []
+
+    start = time.time()
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        for offset, address in requests_to_send:
+            due = start + offset / speed
+
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+            futures.append(executor.submit(send, address, due))
+
+        results = [future.result() for future in futures]
+
+    elapsed = time.time() - start
+
+    by_bucket = defaultdict(list)
+    for result in results:
+        by_bucket[candidateBucket(result[2])].append(result)
+
+    def bucketOrder(bucket):
+        if bucket == 'unknown':
+            return float('inf')
+        if bucket.startswith('>'):
+            return CANDIDATE_BUCKETS[-1] + 1
+        return int(bucket.split('-')[0])
+
+    report = OrderedDict([('commit', gitCommit()),
+                          ('run_at', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                          ('url', url),
+                          ('speed', speed),
+                          ('concurrency', concurrency),
+                          ('seconds', elapsed),
+                          ('requests_per_second', len(results) / elapsed if elapsed else 0.0)])
+
+    report['overall'] = summarize(results)
+    report['by_candidates'] = OrderedDict((bucket, summarize(by_bucket[bucket])) \
+                                              for bucket in sorted(by_bucket, key=bucketOrder))
+
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Replay /geocode/ requests from an access log or a file of addresses.'
+    )
+
+    parser.add_argument('input',
+                        type=str,
+                        help='Access log, or a file with one address per line')
+
+    parser.add_argument('--url',
+                        type=str,
+                        default='http://localhost:5000',
+                        help='Geocoder to send the requests to')
+
+    parser.add_argument('--speed',
+                        type=float,
+                        default=1.0,
+                        help='Multiply the recorded request rate by this much')
+
+    parser.add_argument('--rate',
+                        type=float,
+                        default=None,
+                        help='Requests per second for a file of addresses (defaults to as fast as possible)')
+
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=8,
+                        help='Most requests in flight at once')
+
+    parser.add_argument('--limit',
+                        type=int,
+                        default=None,
+                        help='Only send this many requests')
+
+    parser.add_argument('--timeout',
+                        type=float,
+                        default=30,
+                        help='Seconds to wait for each response')
+
+    parser.add_argument('--output',
+                        type=str,
+                        default=None,
+                        help='Where to write results (defaults to benchmarks/results/replay-<commit>.json)')
+
+    args = parser.parse_args()
+
+    with open(args.input) as f:
+        if isAccessLog(args.input):
+            to_send = list(readAccessLog(f))
+            if not to_send:
+                parser.error('%s looks like an access log but has no /geocode/ '
+                             'requests with a time stamp this can read' % args.input)
+        else:
+            to_send = list(readAddresses(f, args.rate))
+
+    if args.limit:
+        to_send = to_send[:args.limit]
+
+    results = replay(to_send,
+                     url=args.url,
+                     speed=args.speed,
+                     concurrency=args.concurrency,
+                     timeout=args.timeout)
+
+    output = args.output
+    if not output:
+        if not os.path.exists('benchmarks/results'):
+            os.makedirs('benchmarks/results')
+        output = 'benchmarks/results/replay-%s.json' % (results['commit'] or 'unknown')
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(json.dumps(results, indent=2))
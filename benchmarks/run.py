@@ -0,0 +1,330 @@
+'''
+End to end benchmark of the geocoder against a synthetic corpus.
+
+Loads a synthetic cook_county_addresses table of the requested size into
+a scratch database, builds match_blocks and measures block build time,
+single request latency through the Flask app, batch throughput and the
+time of a bulk link job. Results are written as JSON so runs can be
+compared across commits:
+
+    python -m benchmarks.run --scale 100000 \
+        --db postgresql://localhost:5432/geocoder_bench
+'''
+import os
+import csv
+import json
+import time
+import tempfile
+import subprocess
+from collections import OrderedDict
+
+import numpy
+import sqlalchemy as sa
+from sqlalchemy import create_engine
+
+from benchmarks.corpus import canonicalAddresses, messyAddresses
+
+CANONICAL_COLUMNS = OrderedDict([
+    ('id', 'INTEGER'),
+    ('address_id', 'VARCHAR'),
+    ('complete_street_address', 'VARCHAR'),
+    ('usps_place_name', 'VARCHAR'),
+    ('usps_state', 'VARCHAR'),
+    ('zipcode', 'VARCHAR'),
+    ('complete_address', 'VARCHAR'),
+    ('latitude', 'DOUBLE PRECISION'),
+    ('longitude', 'DOUBLE PRECISION'),
+])
+
+MESSY_TABLE = 'bench_messy_addresses'
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+def percentiles(timings):
+    timings = numpy.array(timings) * 1000
+
+    return OrderedDict([('requests', len(timings)),
+                        ('mean_ms', float(timings.mean())),
+                        ('p50_ms', float(numpy.percentile(timings, 50))),
+                        ('p90_ms', float(numpy.percentile(timings, 90))),
+                        ('p99_ms', float(numpy.percentile(timings, 99))),
+                        ('max_ms', float(timings.max()))])
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'])\
+                   .decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def copyRows(engine, table, columns, rows):
+    '''
+    Stream rows through a temporary CSV file into `table` with COPY
+    so the corpus never has to fit in memory.
+    '''
+
+    copy_st = '''
+        COPY {0} ({1}) FROM STDIN WITH (FORMAT CSV)
+    '''.format(table, ','.join(columns))
+
+    with tempfile.TemporaryFile(mode='w+') as f:
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow(row)
+        f.seek(0)
+
+        conn = engine.raw_connection()
+        try:
+            curs = conn.cursor()
+            curs.copy_expert(copy_st, f)
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+def loadCanonical(engine, scale, seed=0):
+    columns = ', '.join('%s %s' % c for c in CANONICAL_COLUMNS.items())
+
+    with engine.begin() as conn:
+        conn.execute('DROP TABLE IF EXISTS cook_county_addresses')
+        conn.execute('CREATE TABLE cook_county_addresses ({0})'.format(columns))
+
+    rows = ([row[c] for c in CANONICAL_COLUMNS] \
+                for row in canonicalAddresses(scale, seed))
+
+    copyRows(engine, 'cook_county_addresses', list(CANONICAL_COLUMNS), rows)
+
+    with engine.begin() as conn:
+        conn.execute('ALTER TABLE cook_county_addresses ADD PRIMARY KEY (id)')
+        conn.execute('ANALYZE cook_county_addresses')
+
+def loadMessy(engine, scale, n_messy, seed=0):
+    with engine.begin() as conn:
+        conn.execute('DROP TABLE IF EXISTS {0}'.format(MESSY_TABLE))
+        conn.execute('''
+            CREATE TABLE {0} (
+                id INTEGER PRIMARY KEY,
+                complete_address VARCHAR,
+                true_id INTEGER,
+                address_id VARCHAR,
+                match_confidence DOUBLE PRECISION
+            )
+        '''.format(MESSY_TABLE))
+
+    messy = list(messyAddresses(scale, n_messy, canonical_seed=seed))
+
+    copyRows(engine, MESSY_TABLE, ['id', 'complete_address', 'true_id'], messy)
+
+    return messy
+
+def buildBlocks(engine, settings_path):
+    from geocoder.deduper import StaticDatabaseGazetteer
+
+    with open(settings_path, 'rb') as sf:
+        deduper = StaticDatabaseGazetteer(sf, engine=engine)
+
+    _, block_seconds = timed(deduper.createMatchBlocksTable)
+    _, messy_block_seconds = timed(deduper.createMatchBlocksTable,
+                                   table_to_block=MESSY_TABLE,
+                                   match_blocks_table='%s_match_blocks' % MESSY_TABLE)
+
+    return OrderedDict([('canonical_seconds', block_seconds),
+                        ('messy_seconds', messy_block_seconds)])
+
+def singleLatency(engine, messy, n_requests):
+    '''
+    Time /geocode/ requests through the Flask test client, with the
+    app pointed at the benchmark database.
+    '''
+
+    import geocoder.database
+    from geocoder import create_app
+
+    geocoder.database.engine = engine
+
+    app = create_app()
+    app.config['EXACT_MATCH'] = False
+    client = app.test_client()
+
+    timings = []
+    correct = 0
+    for _, address, true_id in messy[:n_requests]:
+        start = time.time()
+        response = client.get('/geocode/', query_string={'address': address})
+        timings.append(time.time() - start)
+
+        matches = json.loads(response.data.decode('utf-8'))['matches']
+        if matches and matches[0]['id'] == true_id:
+            correct += 1
+
+    results = percentiles(timings)
+    results['top_match_accuracy'] = float(correct) / len(timings) if timings else 0.0
+
+    return results
+
+def batchThroughput(engine, settings_path, messy, batch_sizes):
+    from geocoder.deduper import GeocodingGazetteer
+
+    with open(settings_path, 'rb') as sf:
+        matcher = GeocodingGazetteer(sf, engine=engine)
+
+    addresses = [address for _, address, _ in messy]
+
+    results = []
+    for batch_size in batch_sizes:
+        batches = [addresses[i:i + batch_size] \
+                       for i in range(0, len(addresses), batch_size)]
+
+        n_pairs = 0
+        scoring_seconds = 0.0
+        start = time.time()
+        for batch in batches:
+            stats = {}
+            matcher.matchBatch(batch, n_matches=5, threshold=0.75, stats=stats)
+            n_pairs += stats['pairs']
+            scoring_seconds += stats['scoring_seconds']
+        elapsed = time.time() - start
+
+        results.append(OrderedDict([
+            ('batch_size', batch_size),
+            ('addresses', len(addresses)),
+            ('seconds', elapsed),
+            ('addresses_per_second', len(addresses) / elapsed if elapsed else 0.0),
+            ('pairs', n_pairs),
+            ('pairs_per_second', n_pairs / scoring_seconds if scoring_seconds else 0.0),
+        ]))
+
+    return results
+
+def linkJob(engine, settings_path, messy):
+    from geocoder.deduper import AddressLinkGazetteer
+
+    with open(settings_path, 'rb') as sf:
+        deduper = AddressLinkGazetteer(sf, engine=engine)
+
+    messy_data_info = {
+        'messy_data_table': MESSY_TABLE,
+        'messy_blocks_table': '%s_match_blocks' % MESSY_TABLE,
+        'primary_key': 'id',
+    }
+
+    matches, seconds = timed(deduper.match, messy_data_info, n_matches=1)
+
+    true_ids = {messy_id: true_id for messy_id, _, true_id in messy}
+    correct = 0
+    for match in matches:
+        for (messy_id, canonical_id), _ in match:
+            if true_ids.get(int(messy_id)) == int(canonical_id):
+                correct += 1
+
+    return OrderedDict([('records', len(messy)),
+                        ('seconds', seconds),
+                        ('records_per_second', len(messy) / seconds if seconds else 0.0),
+                        ('accuracy', float(correct) / len(messy) if messy else 0.0)])
+
+def runBenchmark(db_url,
+                 scale,
+                 settings_path='geocoder/data/dedupe.settings',
+                 n_messy=2000,
+                 n_requests=500,
+                 batch_sizes=(1, 10, 100, 1000),
+                 seed=0,
+                 skip_load=False):
+
+    engine = create_engine(db_url)
+
+    results = OrderedDict([('commit', gitCommit()),
+                           ('run_at', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                           ('scale', scale),
+                           ('messy_records', n_messy)])
+
+    if skip_load:
+        messy = list(messyAddresses(scale, n_messy, canonical_seed=seed))
+    else:
+        _, results['load_seconds'] = timed(loadCanonical, engine, scale, seed)
+        messy = loadMessy(engine, scale, n_messy, seed)
+
+    results['block_build'] = buildBlocks(engine, settings_path)
+    results['single_request'] = singleLatency(engine, messy, n_requests)
+    results['batch'] = batchThroughput(engine, settings_path, messy, batch_sizes)
+    results['link_job'] = linkJob(engine, settings_path, messy)
+
+    engine.dispose()
+
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the geocoder against a synthetic address corpus.'
+    )
+
+    parser.add_argument('--db',
+                        type=str,
+                        default='postgresql://localhost:5432/geocoder_bench',
+                        help='Scratch database to load the corpus into. Its tables are dropped!')
+
+    parser.add_argument('--scale',
+                        type=int,
+                        default=10000,
+                        help='Number of canonical addresses to generate (10k to 5M)')
+
+    parser.add_argument('--messy',
+                        type=int,
+                        default=2000,
+                        help='Number of messy addresses to geocode and link')
+
+    parser.add_argument('--requests',
+                        type=int,
+                        default=500,
+                        help='Number of single /geocode/ requests to time')
+
+    parser.add_argument('--batch_sizes',
+                        type=str,
+                        default='1,10,100,1000',
+                        help='Comma separated batch sizes to measure throughput for')
+
+    parser.add_argument('--settings',
+                        type=str,
+                        default='geocoder/data/dedupe.settings',
+                        help='dedupe settings file to benchmark')
+
+    parser.add_argument('--skip_load',
+                        action='store_true',
+                        help='Reuse the corpus already loaded at this scale')
+
+    parser.add_argument('--output',
+                        type=str,
+                        default=None,
+                        help='Where to write results (defaults to benchmarks/results/<commit>-<scale>.json)')
+
+    args = parser.parse_args()
+
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+
+    results = runBenchmark(args.db,
+                           args.scale,
+                           settings_path=args.settings,
+                           n_messy=args.messy,
+                           n_requests=args.requests,
+                           batch_sizes=batch_sizes,
+                           skip_load=args.skip_load)
+
+    output = args.output
+    if not output:
+        if not os.path.exists('benchmarks/results'):
+            os.makedirs('benchmarks/results')
+        output = 'benchmarks/results/%s-%s.json' % (results['commit'] or 'unknown',
+                                                     args.scale)
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(json.dumps(results, indent=2))
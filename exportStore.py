@@ -0,0 +1,50 @@
+import os
+
+from geocoder.storage import exportSQLite
+from geocoder.mapped_store import exportMapped
+from geocoder.columnar import exportTable
+
+SNAPSHOT_TABLES = ['cook_county_addresses', 'building_footprints']
+
+if __name__ == "__main__":
+    import argparse
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(
+        description='Build an embedded copy of the geocoder tables.'
+    )
+
+    parser.add_argument('--format',
+                        type=str,
+                        choices=['sqlite', 'mmap', 'parquet'],
+                        default='sqlite',
+                        help='A SQLite file, a read only memory mapped file or Parquet snapshots of %s' % ' and '.join(SNAPSHOT_TABLES))
+
+    parser.add_argument('--output',
+                        type=str,
+                        default=None,
+                        help='Where to write the store (defaults to geocoder/data/geocoder.<format>, or the geocoder/data directory for parquet)')
+
+    args = parser.parse_args()
+
+    engine = create_engine('postgresql://localhost:5432/geocoder')
+
+    if args.format == 'parquet':
+        output = args.output or 'geocoder/data'
+
+        for table in SNAPSHOT_TABLES:
+            path = os.path.join(output, '%s.parquet' % table)
+            n_rows = exportTable(engine, table, path)
+            print('Wrote %s rows to %s' % (n_rows, path))
+
+    else:
+        output = args.output or 'geocoder/data/geocoder.%s' % args.format
+
+        if args.format == 'mmap':
+            exportMapped(engine, output)
+        else:
+            exportSQLite(engine, output)
+
+        print('Wrote %s' % output)
+
+    engine.dispose()
@@ -0,0 +1,58 @@
+from geocoder.bulk import geocodeFile
+import geocoder.app_config as app_config
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(
+        description='Geocode a CSV or Parquet file.'
+    )
+
+    parser.add_argument('input',
+                        type=str,
+                        help='CSV or Parquet (.parquet) file to geocode')
+
+    parser.add_argument('output',
+                        type=str,
+                        help='Where to write the results, as CSV or Parquet (.parquet)')
+
+    parser.add_argument('--address_columns',
+                        type=str,
+                        default='address',
+                        help='Column with the address, or a comma separated list of columns to join into one')
+
+    parser.add_argument('--processes',
+                        type=int,
+                        default=None,
+                        help='Number of geocoding processes (defaults to CPU count)')
+
+    parser.add_argument('--chunk_size',
+                        type=int,
+                        default=1000,
+                        help='Rows sent to a process at a time')
+
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=0.75,
+                        help='Lowest confidence to count as a match')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    config = {k: getattr(app_config, k) for k in dir(app_config) if k.isupper()}
+
+    columns = [column.strip() for column in args.address_columns.split(',')]
+
+    n_rows, seconds = geocodeFile(args.input,
+                                  args.output,
+                                  columns,
+                                  config,
+                                  app_config.DB_CONN,
+                                  processes=args.processes,
+                                  chunk_size=args.chunk_size,
+                                  threshold=args.threshold)
+
+    print('Geocoded %d rows in %.1f seconds (%.1f rows/sec)' \
+              % (n_rows, seconds, n_rows / seconds if seconds else 0))
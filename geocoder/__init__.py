@@ -1,3 +1,5 @@
+# First, so cold start times count from here
+from geocoder import coldstart
 from flask import Flask, render_template, g
 from geocoder.api import api
 from geocoder.app_config import TIME_ZONE
@@ -14,6 +16,8 @@ except ImportError:
 except KeyError:
     pass
 
+coldstart.mark('imports')
+
 def create_app():
     app = Flask(__name__)
     config = '{0}.app_config'.format(__name__)
@@ -1,8 +1,15 @@
-from flask import Blueprint, request, make_response, g
+from flask import Blueprint, request, make_response, g, current_app, \
+    Response, stream_with_context
 import json
-from geocoder.deduper import GeocodingGazetteer
-import os
-import sqlalchemy as sa
+from geocoder.exact_match import exactMatches
+from geocoder.models import registry
+from geocoder.normalize import preProcess
+from geocoder.singleflight import SingleFlight
+from geocoder import metrics, coldstart
+from geocoder.streaming import decodeLines, readNDJSON, readCSV, \
+    microBatches, ndjsonLine, CSVWriter
+import time
+import threading
 from datetime import date
 from collections import OrderedDict
 
@@ -10,10 +17,133 @@ api = Blueprint('api', __name__)
 
 dthandler = lambda obj: obj.isoformat() if isinstance(obj, date) else None
 
+# Per process counts of how often the exact match fast path answers
+# a request without going through dedupe
+fast_path_stats = {'requests': 0, 'hits': 0}
+fast_path_lock = threading.Lock()
+
+# Concurrent requests for the same address share one lookup
+inflight = SingleFlight()
+
+def getModels():
+    '''
+    The matcher and store to use for this request. They are loaded on
+    first use and then kept until a reload swaps in new ones.
+    '''
+
+    config = current_app.config
+
+    interval = config.get('RELOAD_WATCH_INTERVAL')
+    if interval:
+        registry.watch(config, g.engine, interval)
+
+    return registry.get(config, g.engine)
+
+def countFastPath(requests, hits):
+    with fast_path_lock:
+        fast_path_stats['requests'] += requests
+        fast_path_stats['hits'] += hits
+
+def fastPathHitRate():
+    with fast_path_lock:
+        requests, hits = fast_path_stats['requests'], fast_path_stats['hits']
+
+    hit_rate = float(hits) / requests if requests else 0.0
+
+    return {'requests': requests, 'hits': hits, 'hit_rate': hit_rate}
+
+def geocodeAddresses(models, 
+                     addresses, 
+                     n_matches=5, 
+                     threshold=0.75, 
+                     timings=None):
+    '''
+    Returns a list with the (canonical id, confidence) matches for
+    each address, whether each one came from the exact match fast path,
+    the scoring stats of the batch sent to dedupe, if any, and the 
+    canonical records of all of the matches by id. If a `timings` dict 
+    is passed in, the seconds spent in each stage are added to it.
+    '''
+
+    if timings is None:
+        timings = OrderedDict()
+
+    exact_ids = {}
+    if current_app.config.get('EXACT_MATCH', False):
+        start = time.time()
+        exact_ids = exactMatches(models.store, addresses)
+        timings['exact_match'] = time.time() - start
+        countFastPath(len(addresses), len(exact_ids))
+
+    results = [[(exact_ids[idx], 1.0)] if idx in exact_ids else None \
+                   for idx in range(len(addresses))]
+    fast_path = [idx in exact_ids for idx in range(len(addresses))]
+
+    misses = [idx for idx, result in enumerate(results) if result is None]
+
+    batch_stats = None
+    records = {}
+    if misses:
+        batch_stats = {}
+        matches = models.matcher.matchBatch(
+                      [addresses[idx] for idx in misses],
+                      n_matches=n_matches,
+                      threshold=threshold,
+                      stats=batch_stats,
+                      records=records)
+
+        for idx, match in zip(misses, matches):
+            results[idx] = match
+
+        timings.update(batch_stats['timings'])
+
+    # Only the records that didn't come along with the candidates
+    # need another trip to the store
+    match_ids = {int(match_id) for matches in results \
+                     for match_id, _ in matches}
+    missing = match_ids.difference(records)
+    if missing:
+        start = time.time()
+        records.update(models.store.records(missing))
+        timings['records'] = time.time() - start
+
+    for stage in ('exact_match', 'records'):
+        if stage in timings:
+            metrics.stage_seconds.observe(timings[stage], stage)
+
+    return results, fast_path, batch_stats, records
+
+def geocodeOne(models, address, n_matches, threshold):
+    timings = OrderedDict()
+    results, fast_path, batch_stats, records = geocodeAddresses(models,
+                                                                [address],
+                                                                n_matches=n_matches,
+                                                                threshold=threshold,
+                                                                timings=timings)
+
+    # For a single address every pair scored is one candidate
+    n_candidates = batch_stats['pairs'] if batch_stats else 0
+
+    return matchRecords(results[0], records), fast_path[0], timings, n_candidates
+
+def matchRecords(matches, records):
+    match_records = []
+
+    for match_id, confidence in matches:
+        m = OrderedDict(records[int(match_id)])
+        m['confidence'] = float(confidence)
+        match_records.append(m)
+
+    return match_records
+
+def debugTimings():
+    return request.args.get('debug') == 'timings'
+
 @api.route('/geocode/')
 def geocode():
+    start = time.time()
     address = request.args.get('address')
-    
+
     resp = {'status': 'ok', 'message': ''}
     status_code = 200
 
@@ -21,49 +151,248 @@ def geocode():
         resp['status'] = 'error'
         resp['message'] = 'address is required'
         status_code = 400
-    
+
     if status_code == 200:
-        match_blob = {'complete_address': address}
-        
-        settings_file = os.path.abspath(
-                            os.path.join(
-                                os.path.dirname(__file__), 
-                                'data',
-                                'dedupe.settings'))
-
-        with open(settings_file, 'rb') as sf:
-            matcher = GeocodingGazetteer(sf, engine=g.engine)
-        
-        matches = matcher.match(match_blob, n_matches=5, threshold=0.75)
-        
-        match_ids = []
-        confidences = {}
-
-        for match in matches:
-            for link in match:
-                (_, match_id), confidence = link
-                match_ids.append(int(match_id))
-                confidences[int(match_id)] = float(confidence)
-        
-        select_matches = ''' 
-            SELECT * FROM cook_county_addresses
-            WHERE id IN :match_ids
-        '''
-        
-        match_records = []
-    
-        if match_ids:
-            curs =  g.engine.execute(sa.text(select_matches), 
-                                     match_ids=tuple(match_ids))
-            for match in curs:
-                m = OrderedDict(zip(match.keys(), match.values()))
-                m['confidence'] = confidences[m['id']]
-                match_records.append(m)
-        
-        resp['matches'] = match_records
-
-        del matcher
-    
-    response = make_response(json.dumps(resp, default=dthandler))
+        models = getModels()
+        n_matches, threshold = 5, 0.75
+
+        key = (preProcess(address), n_matches, threshold, models.version)
+
+        matches, fast_path, timings, n_candidates = inflight.do(key,
+                                                                geocodeOne,
+                                                                models,
+                                                                address,
+                                                                n_matches,
+                                                                threshold)
+
+        resp['matches'] = matches
+        resp['fast_path'] = fast_path
+
+        if debugTimings():
+            resp['timings'] = timings
+            resp['candidates'] = n_candidates
+
+    return timedResponse(resp, 'geocode', start, status_code)
+
+def timedResponse(resp, endpoint, start, status_code=200):
+    serialize_start = time.time()
+    body = json.dumps(resp, default=dthandler)
+    end = time.time()
+
+    metrics.stage_seconds.observe(end - serialize_start, 'serialize')
+    metrics.stage_seconds.observe(end - start, 'request')
+    metrics.requests_total.inc(label_value=endpoint)
+
+    response = make_response(body, status_code)
     response.headers['Content-Type'] = 'application/json'
     return response
+
+@api.route('/geocode/batch/', methods=['POST'])
+def geocode_batch():
+    '''
+    Accepts a JSON body like {"addresses": ["<address>", ...]} and
+    scores all of the addresses together.
+    '''
+
+    start = time.time()
+
+    resp = {'status': 'ok', 'message': ''}
+    status_code = 200
+
+    payload = request.get_json(force=True, silent=True) or {}
+    addresses = payload.get('addresses')
+
+    max_size = current_app.config.get('BATCH_MAX_SIZE', 1000)
+
+    if not addresses or not isinstance(addresses, list):
+        resp['status'] = 'error'
+        resp['message'] = 'addresses is required'
+        status_code = 400
+
+    elif len(addresses) > max_size:
+        resp['status'] = 'error'
+        resp['message'] = 'at most %s addresses can be sent at once' % max_size
+        status_code = 400
+
+    if status_code == 200:
+        addresses = [str(address or '') for address in addresses]
+
+        models = getModels()
+        results, fast_path, batch_stats, records = geocodeAddresses(models,
+                                                                    addresses)
+
+        resp['results'] = [{'address': address,
+                            'matches': matchRecords(matches, records),
+                            'fast_path': hit} \
+                               for address, matches, hit \
+                               in zip(addresses, results, fast_path)]
+        resp['stats'] = batch_stats
+
+    return timedResponse(resp, 'geocode_batch', start, status_code)
+
+@api.route('/geocode/stream', methods=['POST'])
+@api.route('/geocode/stream/', methods=['POST'])
+def geocode_stream():
+    '''
+    Geocodes an upload of any size, read and answered line by line. 
+    Send NDJSON (one {"address": ...} object or address string per 
+    line) or, with a text/csv content type, a CSV with an address 
+    column. Pass `column` to read the address from another field. 
+    Results come back in the same format, in the same order, as each 
+    micro-batch is scored.
+    '''
+
+    is_csv = request.mimetype == 'text/csv'
+    column = request.args.get('column', 'address')
+    batch_size = current_app.config.get('STREAM_BATCH_SIZE', 100)
+
+    lines = decodeLines(request.stream)
+    rows = readCSV(lines, column) if is_csv else readNDJSON(lines, column)
+
+    models = getModels()
+
+    metrics.requests_total.inc(label_value='geocode_stream')
+
+    def results():
+        writer = CSVWriter() if is_csv else None
+
+        for batch in microBatches(rows, batch_size):
+            addresses = [address for _, address, error in batch if not error]
+
+            matches = iter([])
+            if addresses:
+                found, fast_path, _, records = geocodeAddresses(models, addresses)
+                matches = zip(found, fast_path)
+
+            output = []
+            for row, address, error in batch:
+                match_records, hit = [], False
+                if not error:
+                    found_matches, hit = next(matches)
+                    match_records = matchRecords(found_matches, records)
+
+                if writer is not None:
+                    output.append(writer.line(row, match_records, hit, error))
+                else:
+                    output.append(ndjsonLine(row, match_records, hit, error, dthandler))
+
+            yield ''.join(output)
+
+    mimetype = 'text/csv' if is_csv else 'application/x-ndjson'
+
+    return Response(stream_with_context(results()), mimetype=mimetype)
+
+@api.route('/geocode/stats/')
+def geocode_stats():
+    resp = {'status': 'ok', 'message': ''}
+    resp['fast_path'] = fastPathHitRate()
+    resp['coalescing'] = inflight.snapshot()
+
+    models = registry.models
+    if models is not None and models.matcher.bloom_filter is not None:
+        resp['bloom_filter'] = models.matcher.bloom_filter.report()
+
+    response = make_response(json.dumps(resp))
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+@api.route('/reload/', methods=['GET', 'POST'])
+def reload_models():
+    '''
+    Reports the loaded model version. With a POST, also starts loading
+    the settings file and store from disk and swaps them in when done.
+    Pass `wait=true` to return only once the reload has finished.
+    Requires `key` to match FLUSH_KEY.
+    '''
+
+    resp = {'status': 'ok', 'message': ''}
+    status_code = 200
+
+    key = request.values.get('key')
+
+    if not key or key != current_app.config.get('FLUSH_KEY'):
+        resp['status'] = 'error'
+        resp['message'] = 'a valid key is required'
+        status_code = 403
+
+    elif request.method == 'POST':
+        wait = request.values.get('wait') == 'true'
+
+        started = registry.reload(current_app.config,
+                                  g.engine,
+                                  background=not wait)
+
+        if not started:
+            resp['message'] = 'a reload is already running'
+            status_code = 409
+
+    if status_code != 403:
+        resp['reload'] = registry.status
+
+    response = make_response(json.dumps(resp), status_code)
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+@api.route('/ready/')
+def ready():
+    '''
+    Readiness probe: passes once the models are loaded and warmed up by
+    `registry.warmUp`, as serve.py does before forking its workers
+    '''
+
+    resp = {'status': 'ok', 'message': ''}
+    status_code = 200
+
+    if not registry.status['ready']:
+        resp['status'] = 'error'
+        resp['message'] = 'warming up'
+        status_code = 503
+
+    response = make_response(json.dumps(resp), status_code)
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+@api.route('/metrics')
+def metrics_endpoint():
+    '''
+    Stage timings, candidate counts, cache and pool statistics of this 
+    process in the Prometheus text format
+    '''
+
+    fast_path = fastPathHitRate()
+    coalescing = inflight.snapshot()
+
+    gauges = [
+        ('geocoder_fast_path', 'Exact match fast path lookups and hits',
+         [([('kind', 'requests')], fast_path['requests']),
+          ([('kind', 'hits')], fast_path['hits'])]),
+        ('geocoder_coalescing', 'Concurrent identical requests sharing one lookup',
+         [([('kind', kind)], value) for kind, value in sorted(coalescing.items())]),
+        ('geocoder_models_version', 'Version of the loaded models',
+         [([], registry.status['version'])]),
+        ('geocoder_models_load_seconds', 'Time the last model load took',
+         [([], registry.status['load_seconds'])]),
+        ('geocoder_cold_start_seconds', 'Time each start up step of this process took',
+         [([('step', step)], seconds) for step, seconds in coldstart.report().items()]),
+    ]
+
+    models = registry.models
+    if models is not None and models.matcher.bloom_filter is not None:
+        bloom = models.matcher.bloom_filter.report()
+        gauges.append(('geocoder_bloom_filter', 'Block key Bloom filter counts',
+                       [([('kind', kind)], bloom[kind]) \
+                            for kind in ('checked_keys', 'dropped_keys', 'skipped_lookups')]))
+        gauges.append(('geocoder_bloom_filter_expected_error_rate', 
+                       'Expected false positive rate of the Bloom filter',
+                       [([], bloom['expected_error_rate'])]))
+
+    pool = getattr(getattr(g, 'engine', None), 'pool', None)
+    if pool is not None and hasattr(pool, 'checkedout'):
+        gauges.append(('geocoder_db_pool', 'Database connection pool',
+                       [([('state', 'size')], pool.size()),
+                        ([('state', 'checked_out')], pool.checkedout()),
+                        ([('state', 'overflow')], pool.overflow())]))
+
+    response = make_response(metrics.registry.render(gauges))
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    return response
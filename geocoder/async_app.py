@@ -0,0 +1,337 @@
+'''
+asyncio serving mode for /geocode/ and /geocode/batch/.
+
+Candidate and record queries go through a pool of asyncpg connections
+while blocking and scoring run in a bounded pool of worker processes,
+so a single process can keep hundreds of requests waiting on the
+database at once. Responses are the same as the Flask endpoints' for
+the plain match_blocks table; the partitioned and packed block tables
+and the trigram fallback aren't supported and refuse to start.
+'''
+import os
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import asyncpg
+from aiohttp import web
+
+from geocoder.api import dthandler, matchRecords
+from geocoder.exact_match import addressKeys, uniqueMatches
+from geocoder.models import SETTINGS_FILE, loadModels
+from geocoder.storage import PostgresStore, RECORD_COLUMNS, projection, queryKeys
+from geocoder.normalize import preProcess
+from geocoder.singleflight import AsyncSingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Set up once per scoring process by initScorer
+scorer = None
+
+def initScorer(settings_path, parsed_addresses_path=None):
+    global scorer
+    from geocoder.deduper import GeocodingGazetteer
+    from geocoder.parsed_addresses import ParsedAddresses
+
+    parsed_addresses = None
+    if parsed_addresses_path:
+        parsed_addresses = ParsedAddresses(parsed_addresses_path)
+
+    with open(settings_path, 'rb') as sf:
+        scorer = GeocodingGazetteer(sf, 
+                                    num_cores=1, 
+                                    parsed_addresses=parsed_addresses)
+
+def blockAddresses(addresses):
+    return scorer.blockKeys(addresses)
+
+def scoreAddresses(messy_records, candidates, threshold, n_matches):
+    return scorer.scoreCandidates(messy_records,
+                                  candidates,
+                                  threshold=threshold,
+                                  n_matches=n_matches)
+
+
+class AsyncPostgresStore(object):
+    '''
+    The lookups of PostgresStore on a pool of asyncpg connections
+    '''
+
+    def __init__(self,
+                 pool,
+                 addresses_table='cook_county_addresses',
+                 match_blocks_table='match_blocks',
+                 exact_match_table='exact_match_addresses',
+                 columns=RECORD_COLUMNS,
+                 hashed_keys=False):
+
+        self.pool = pool
+        self.addresses_table = addresses_table
+        self.match_blocks_table = match_blocks_table
+        self.exact_match_table = exact_match_table
+        self.columns = projection(columns)
+        self.hashed_keys = hashed_keys
+
+    async def blockedRecords(self, block_keys, columns=None):
+        columns = projection(columns)
+
+        sel = '''
+            SELECT
+              blocks.block_key,
+              {2}
+            FROM {0} AS addresses
+            JOIN {1} AS blocks
+              USING(id)
+            WHERE blocks.block_key = ANY($1::{3}[])
+        '''.format(self.addresses_table,
+                   self.match_blocks_table,
+                   ', '.join('addresses.%s' % c for c in columns),
+                   'bigint' if self.hashed_keys else 'varchar')
+
+        keys = queryKeys(block_keys, self.hashed_keys)
+
+        rows = await self.pool.fetch(sel, list(keys))
+
+        return [(keys[row['block_key']], 
+                 row['id'], 
+                 OrderedDict((c, row[c]) for c in columns)) \
+                    for row in rows]
+
+    async def records(self, ids):
+        if not ids:
+            return {}
+
+        sel = '''
+            SELECT {1} FROM {0}
+            WHERE id = ANY($1::int[])
+        '''.format(self.addresses_table, ', '.join(self.columns))
+
+        rows = await self.pool.fetch(sel, list(ids))
+
+        return {row['id']: OrderedDict(row.items()) for row in rows}
+
+    async def exactMatchIds(self, address_keys):
+        if not address_keys:
+            return {}
+
+        sel = '''
+            SELECT DISTINCT address_key, id
+            FROM {0}
+            WHERE address_key = ANY($1::varchar[])
+        '''.format(self.exact_match_table)
+
+        rows = await self.pool.fetch(sel, list(address_keys))
+
+        ids = {}
+        for row in rows:
+            ids.setdefault(row['address_key'], set()).add(row['id'])
+
+        return ids
+
+
+class AsyncGeocoder(object):
+    '''
+    Runs the stages of GeocodingGazetteer.matchBatch with the database
+    lookups awaited and the CPU bound stages sent to `executor`.
+    At most `max_pending` batches wait on the executor at a time.
+    '''
+
+    def __init__(self, matcher, store, executor, max_pending, exact_match=False):
+        self.matcher = matcher
+        self.store = store
+        self.executor = executor
+        self.exact_match = exact_match
+        self.pending = asyncio.Semaphore(max_pending)
+        self.inflight = AsyncSingleFlight()
+
+    async def run(self, func, *args):
+        async with self.pending:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    async def exactMatches(self, addresses):
+        address_keys = addressKeys(addresses)
+        ids = await self.store.exactMatchIds(list(address_keys))
+
+        return uniqueMatches(address_keys, ids)
+
+    async def matchBatch(self, addresses, threshold=0.75, n_matches=5, records=None):
+        messy_records, block_keys = await self.run(blockAddresses, addresses)
+
+        block_keys, all_keys = self.matcher.lookupKeys(block_keys)
+
+        candidates = {}
+        if all_keys:
+            blocked_records = await self.store.blockedRecords(
+                                  all_keys, 
+                                  self.matcher.record_columns)
+            candidates = self.matcher.groupCandidates(block_keys, blocked_records)
+
+        results = await self.run(scoreAddresses,
+                                 messy_records,
+                                 candidates,
+                                 threshold,
+                                 n_matches)
+
+        if records is not None:
+            self.matcher.matchedRecords(candidates, results, records)
+
+        return results
+
+    async def geocode(self, addresses):
+        exact_ids = {}
+        if self.exact_match:
+            exact_ids = await self.exactMatches(addresses)
+
+        misses = [idx for idx in range(len(addresses)) if idx not in exact_ids]
+
+        results = [[(exact_ids[idx], 1.0)] if idx in exact_ids else [] \
+                       for idx in range(len(addresses))]
+
+        records = {}
+        if misses:
+            matches = await self.matchBatch([addresses[idx] for idx in misses],
+                                            records=records)
+            for idx, match in zip(misses, matches):
+                results[idx] = match
+
+        match_ids = {int(match_id) for matches in results \
+                         for match_id, _ in matches}
+        records.update(await self.store.records(match_ids.difference(records)))
+
+        return [(matchRecords(matches, records), idx in exact_ids) \
+                    for idx, matches in enumerate(results)]
+
+
+def jsonResponse(resp):
+    return web.Response(text=json.dumps(resp, default=dthandler),
+                        content_type='application/json')
+
+async def geocode(request):
+    address = request.query.get('address')
+
+    resp = {'status': 'ok', 'message': ''}
+
+    if not address:
+        resp['status'] = 'error'
+        resp['message'] = 'address is required'
+        return jsonResponse(resp)
+
+    geocoder = request.app['geocoder']
+
+    (matches, fast_path), = await geocoder.inflight.do(preProcess(address),
+                                                       geocoder.geocode,
+                                                       [address])
+
+    resp['matches'] = matches
+    resp['fast_path'] = fast_path
+
+    return jsonResponse(resp)
+
+async def geocode_batch(request):
+    resp = {'status': 'ok', 'message': ''}
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = {}
+
+    addresses = payload.get('addresses') if isinstance(payload, dict) else None
+
+    max_size = request.app['config'].get('BATCH_MAX_SIZE', 1000)
+
+    if not addresses or not isinstance(addresses, list):
+        resp['status'] = 'error'
+        resp['message'] = 'addresses is required'
+        return jsonResponse(resp)
+
+    if len(addresses) > max_size:
+        resp['status'] = 'error'
+        resp['message'] = 'at most %s addresses can be sent at once' % max_size
+        return jsonResponse(resp)
+
+    addresses = [str(address or '') for address in addresses]
+
+    results = await request.app['geocoder'].geocode(addresses)
+
+    resp['results'] = [{'address': address,
+                        'matches': matches,
+                        'fast_path': fast_path} \
+                           for address, (matches, fast_path) \
+                           in zip(addresses, results)]
+
+    return jsonResponse(resp)
+
+async def geocode_stats(request):
+    resp = {'status': 'ok', 'message': ''}
+    resp['coalescing'] = request.app['geocoder'].inflight.snapshot()
+
+    return jsonResponse(resp)
+
+def createAsyncApp(config,
+                   engine,
+                   dsn,
+                   pool_size=20,
+                   scoring_processes=None,
+                   max_pending=None):
+    '''
+    `config` is the app_config settings and `engine` a SQLAlchemy engine
+    used once at startup to load the oversized block keys.
+    '''
+
+    scoring_processes = scoring_processes or os.cpu_count()
+    max_pending = max_pending or 4 * scoring_processes
+
+    unsupported = [option for option in ('PARTITIONED_BLOCKS',
+                                         'PACKED_BLOCKS',
+                                         'FALLBACK_CANDIDATES') \
+                       if config.get(option)]
+    if unsupported:
+        raise ValueError('The async server only reads match_blocks, '
+                         'unset %s' % ', '.join(unsupported))
+
+    app = web.Application()
+    app['config'] = config
+
+    async def startup(app):
+        loop = asyncio.get_event_loop()
+
+        models = await loop.run_in_executor(None, loadModels, config, engine, 1)
+        engine.dispose()
+
+        if not isinstance(models.store, PostgresStore):
+            raise ValueError('The async server only reads from Postgres, '
+                             'unset MAPPED_STORE and EMBEDDED_STORE')
+
+        settings_path = config.get('SETTINGS_FILE', SETTINGS_FILE)
+        app['executor'] = ProcessPoolExecutor(scoring_processes,
+                                              initializer=initScorer,
+                                              initargs=(settings_path,
+                                                        config.get('PARSED_ADDRESSES')))
+
+        app['pool'] = await asyncpg.create_pool(dsn,
+                                                min_size=min(pool_size, 5),
+                                                max_size=pool_size)
+
+        app['geocoder'] = AsyncGeocoder(models.matcher,
+                                        AsyncPostgresStore(app['pool'],
+                                                           columns=models.store.columns,
+                                                           hashed_keys=models.store.hashed_keys),
+                                        app['executor'],
+                                        max_pending,
+                                        exact_match=config.get('EXACT_MATCH', False))
+
+    async def cleanup(app):
+        await app['pool'].close()
+        app['executor'].shutdown()
+
+    app.on_startup.append(startup)
+    app.on_cleanup.append(cleanup)
+
+    app.router.add_get('/geocode/', geocode)
+    app.router.add_get('/geocode/stats/', geocode_stats)
+    app.router.add_post('/geocode/batch/', geocode_batch)
+
+    return app
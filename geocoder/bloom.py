@@ -0,0 +1,197 @@
+import os
+import math
+import struct
+import threading
+
+import numpy
+
+from geocoder.storage import blockKeyHash
+
+MAGIC = b'GEOBLOOM'
+
+# magic, number of bits, number of hash functions, number of keys,
+# target false positive rate
+HEADER = struct.Struct('<8sQIQd')
+
+class BloomFilter(object):
+    '''
+    Compact set of block keys that can answer "definitely not a block
+    key" without a database lookup. Keys are added and tested by their
+    blockKeyHash, so a filter built from a hashed match_blocks table
+    works the same as one built from the key strings.
+    '''
+
+    def __init__(self, n_bits, n_hashes, n_keys=0, error_rate=None, bits=None):
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        self.n_keys = n_keys
+        self.error_rate = error_rate
+
+        if bits is None:
+            bits = numpy.zeros((n_bits + 7) // 8, dtype='uint8')
+        self.bits = bits
+
+        self.lock = threading.Lock()
+        self.stats = {'checked_keys': 0, 'dropped_keys': 0, 'skipped_lookups': 0}
+
+    @classmethod
+    def forCapacity(cls, n_keys, error_rate=0.01):
+        '''
+        An empty filter sized to hold `n_keys` keys with about
+        `error_rate` false positives
+        '''
+
+        n_keys = max(n_keys, 1)
+        n_bits = int(math.ceil(-n_keys * math.log(error_rate) / math.log(2) ** 2))
+        n_hashes = max(1, int(round(float(n_bits) / n_keys * math.log(2))))
+
+        return cls(n_bits, n_hashes, error_rate=error_rate)
+
+    def _positions(self, key_hashes):
+        key_hashes = numpy.asarray(key_hashes, dtype='uint64')
+
+        # Double hashing on the two halves of the 64 bit key hash
+        low = key_hashes & numpy.uint64(0xffffffff)
+        high = (key_hashes >> numpy.uint64(32)) | numpy.uint64(1)
+
+        for i in range(self.n_hashes):
+            yield (low + numpy.uint64(i) * high) % numpy.uint64(self.n_bits)
+
+    def addHashes(self, key_hashes):
+        for positions in self._positions(key_hashes):
+            numpy.bitwise_or.at(self.bits,
+                                (positions >> numpy.uint64(3)).astype('int64'),
+                                (numpy.uint8(1) << (positions & numpy.uint64(7)).astype('uint8')))
+
+        self.n_keys += len(key_hashes)
+
+    def containsHashes(self, key_hashes):
+        found = numpy.ones(len(key_hashes), dtype=bool)
+
+        for positions in self._positions(key_hashes):
+            byte = self.bits[(positions >> numpy.uint64(3)).astype('int64')]
+            found &= (byte >> (positions & numpy.uint64(7)).astype('uint8')) & 1 == 1
+
+        return found
+
+    def __contains__(self, key):
+        return bool(self.containsHashes([blockKeyHash(key)])[0])
+
+    def expectedErrorRate(self):
+        '''
+        False positive rate for the number of keys actually added
+        '''
+
+        if not self.n_keys:
+            return 0.0
+
+        return (1 - math.exp(-float(self.n_hashes) * self.n_keys / self.n_bits)) \
+                   ** self.n_hashes
+
+    def measuredErrorRate(self, n_samples=100000, seed=0):
+        '''
+        Share of random keys, which are almost certainly not in the
+        filter, that it reports as present
+        '''
+
+        random = numpy.random.RandomState(seed)
+        key_hashes = numpy.frombuffer(random.bytes(8 * n_samples), dtype='uint64')
+
+        return float(self.containsHashes(key_hashes).mean())
+
+    def filterKeys(self, block_keys):
+        '''
+        Drop the keys of each messy record that can't be in the block
+        table. Takes and returns a dict of sets of keys by messy record.
+        '''
+
+        filtered = {}
+        checked = dropped = 0
+
+        for messy_id, keys in block_keys.items():
+            keys = list(keys)
+            found = self.containsHashes([blockKeyHash(key) for key in keys])
+            filtered[messy_id] = {key for key, hit in zip(keys, found) if hit}
+
+            checked += len(keys)
+            dropped += len(keys) - len(filtered[messy_id])
+
+        with self.lock:
+            self.stats['checked_keys'] += checked
+            self.stats['dropped_keys'] += dropped
+            if checked and checked == dropped:
+                self.stats['skipped_lookups'] += 1
+
+        return filtered
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+
+        stats.update({'bits': self.n_bits,
+                      'hashes': self.n_hashes,
+                      'keys': self.n_keys,
+                      'target_error_rate': self.error_rate,
+                      'expected_error_rate': self.expectedErrorRate()})
+
+        return stats
+
+    def save(self, path):
+        tmp_path = '%s.tmp' % path
+
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC,
+                                self.n_bits,
+                                self.n_hashes,
+                                self.n_keys,
+                                self.error_rate or 0.0))
+            f.write(self.bits.tobytes())
+
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic, n_bits, n_hashes, n_keys, error_rate = \
+                HEADER.unpack(f.read(HEADER.size))
+
+            if magic != MAGIC:
+                raise ValueError('%s is not a block key filter' % path)
+
+            bits = numpy.frombuffer(f.read(), dtype='uint8')
+
+        return cls(n_bits, n_hashes, n_keys, error_rate or None, bits)
+
+
+def buildBloomFilter(engine,
+                     path,
+                     match_blocks_table='match_blocks',
+                     error_rate=0.01,
+                     batch_size=100000):
+    '''
+    Build a filter over every key in the block stats table and save it
+    to `path`
+    '''
+
+    n_keys = engine.execute('''
+        SELECT COUNT(*) FROM {0}_stats
+    '''.format(match_blocks_table)).scalar()
+
+    bloom = BloomFilter.forCapacity(n_keys, error_rate)
+
+    sel = 'SELECT block_key FROM {0}_stats'.format(match_blocks_table)
+
+    with engine.connect() as conn:
+        rows = conn.execution_options(stream_results=True).execute(sel)
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                break
+            # Hashed tables hold the signed hash already
+            bloom.addHashes([key % (1 << 64) if isinstance(key, int) \
+                                 else blockKeyHash(key) \
+                                 for key, in batch])
+
+    bloom.save(path)
+
+    return bloom
@@ -0,0 +1,238 @@
+'''
+Geocoding a CSV or Parquet file outside of the web app. Rows are read
+in chunks and geocoded by a pool of processes, each loading the dedupe
+settings and opening the store once, and the results are written in
+the order of the input.
+'''
+import os
+import sys
+import csv
+import time
+import multiprocessing
+from collections import OrderedDict
+
+from sqlalchemy import create_engine
+
+from geocoder.models import loadModels
+from geocoder.exact_match import exactMatches
+from geocoder.streaming import CSV_MATCH_COLUMNS
+
+# Set in each worker by initWorker
+worker = {}
+
+def isParquet(path):
+    return os.path.splitext(path)[1].lower() in ('.parquet', '.pq')
+
+def readChunks(path, chunk_size):
+    '''
+    Yields lists of up to `chunk_size` rows, as dicts, from a CSV or
+    Parquet file
+    '''
+
+    if isParquet(path):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+
+    else:
+        with open(path, newline='') as f:
+            chunk = []
+            for row in csv.DictReader(f):
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+def inputColumns(path):
+    if isParquet(path):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).schema_arrow.names
+
+    with open(path, newline='') as f:
+        return next(csv.reader(f), [])
+
+def addressFrom(row, columns):
+    '''
+    The address of a row, joining `columns` with spaces so an address
+    split across street, city and zip columns can be geocoded
+    '''
+
+    return ' '.join(str(row[column]) for column in columns \
+                        if row.get(column) not in (None, '')).strip()
+
+def initWorker(config, db_conn):
+    engine = create_engine(db_conn)
+    worker['models'] = loadModels(config, engine, 1)
+    worker['exact_match'] = config.get('EXACT_MATCH', False)
+
+def geocodeChunk(args):
+    '''
+    Geocode one chunk of rows in a worker. Returns the rows with the
+    best match's columns added.
+    '''
+
+    rows, columns, threshold = args
+
+    models = worker['models']
+
+    addresses = [addressFrom(row, columns) for row in rows]
+    to_match = [idx for idx, address in enumerate(addresses) if address]
+
+    exact_ids = {}
+    if worker['exact_match'] and to_match:
+        found = exactMatches(models.store, [addresses[idx] for idx in to_match])
+        exact_ids = {to_match[i]: match_id for i, match_id in found.items()}
+
+    results = {idx: [(match_id, 1.0)] for idx, match_id in exact_ids.items()}
+
+    misses = [idx for idx in to_match if idx not in exact_ids]
+
+    records = {}
+    if misses:
+        matches = models.matcher.matchBatch([addresses[idx] for idx in misses],
+                                            threshold=threshold,
+                                            n_matches=1,
+                                            records=records)
+        results.update(zip(misses, matches))
+
+    match_ids = {int(matches[0][0]) for matches in results.values() if matches}
+    missing = match_ids.difference(records)
+    if missing:
+        records.update(models.store.records(missing))
+
+    geocoded = []
+    for idx, row in enumerate(rows):
+        row = OrderedDict(row)
+        for column in CSV_MATCH_COLUMNS:
+            row[column] = None
+
+        matches = results.get(idx)
+        if matches:
+            match_id, confidence = matches[0]
+            record = records[int(match_id)]
+            row.update([('match_id', int(match_id)),
+                        ('match_address', record.get('complete_address')),
+                        ('match_latitude', record.get('latitude')),
+                        ('match_longitude', record.get('longitude')),
+                        ('match_confidence', float(confidence)),
+                        ('match_fast_path', idx in exact_ids)])
+
+        geocoded.append(row)
+
+    return geocoded
+
+
+class CSVOutput(object):
+
+    def __init__(self, path):
+        self.f = open(path, 'w', newline='')
+        self.writer = None
+
+    def write(self, rows):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.f, list(rows[0]))
+            self.writer.writeheader()
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetOutput(object):
+    '''
+    Writes each chunk as a row group. The input columns keep the types
+    they have in the input file, so a column that happens to be empty
+    in the first chunk doesn't end up typed as null.
+    '''
+
+    def __init__(self, path, input_path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+
+        if isParquet(input_path):
+            fields = list(pq.ParquetFile(input_path).schema_arrow)
+        else:
+            fields = [pa.field(column, pa.string()) \
+                          for column in inputColumns(input_path)]
+
+        fields += [pa.field('match_id', pa.int64()),
+                   pa.field('match_address', pa.string()),
+                   pa.field('match_latitude', pa.float64()),
+                   pa.field('match_longitude', pa.float64()),
+                   pa.field('match_confidence', pa.float64()),
+                   pa.field('match_fast_path', pa.bool_())]
+
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def geocodeFile(input_path,
+                output_path,
+                columns,
+                config,
+                db_conn,
+                processes=None,
+                chunk_size=1000,
+                threshold=0.75,
+                progress=sys.stderr):
+    '''
+    Geocode every row of `input_path` and write it to `output_path`
+    with the id, address, coordinates and confidence of its best
+    match. Either file can be a CSV or, given a .parquet extension, a
+    Parquet file. Returns the number of rows and the seconds taken.
+    '''
+
+    processes = processes or os.cpu_count()
+
+    clashes = set(inputColumns(input_path)).intersection(CSV_MATCH_COLUMNS)
+    if clashes:
+        raise ValueError('%s already has columns named %s, which the '
+                         'matches would overwrite' \
+                             % (input_path, ', '.join(sorted(clashes))))
+
+    output = ParquetOutput(output_path, input_path) if isParquet(output_path) \
+                 else CSVOutput(output_path)
+
+    chunks = ((chunk, columns, threshold) \
+                  for chunk in readChunks(input_path, chunk_size))
+
+    start = time.time()
+    n_rows = 0
+    n_matched = 0
+
+    pool = multiprocessing.Pool(processes,
+                                initializer=initWorker,
+                                initargs=(config, db_conn))
+
+    try:
+        for rows in pool.imap(geocodeChunk, chunks):
+            output.write(rows)
+
+            n_rows += len(rows)
+            n_matched += sum(1 for row in rows if row['match_id'] is not None)
+
+            if progress:
+                elapsed = time.time() - start
+                progress.write('%d rows, %d matched, %.1f rows/sec\n' \
+                                   % (n_rows, n_matched, n_rows / elapsed))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        output.close()
+
+    return n_rows, time.time() - start
@@ -0,0 +1,111 @@
+'''
+Where the start up time of a process goes. `mark` records when each
+start up step finishes and `report` gives the seconds each one took,
+counted from when this module was first imported, which the geocoder
+package does before anything else.
+
+Run as a module to see which imports a fresh process spends its time
+on:
+
+    python -m geocoder.coldstart --module geocoder --top 20
+'''
+import sys
+import time
+import logging
+import subprocess
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+STARTED = time.time()
+
+marks = OrderedDict()
+
+def mark(step):
+    '''
+    Record that `step` is done. Only the first time counts, so reloads
+    don't show up as start up.
+    '''
+
+    if step not in marks:
+        marks[step] = time.time()
+
+def report():
+    '''
+    Seconds spent in each marked step and in total
+    '''
+
+    steps = OrderedDict()
+
+    previous = STARTED
+    for step, at in marks.items():
+        steps[step] = at - previous
+        previous = at
+
+    steps['total'] = previous - STARTED
+
+    return steps
+
+def logReport():
+    logger.info('Cold start: %s',
+                ', '.join('%s %fs' % (step, seconds) \
+                              for step, seconds in report().items()))
+
+def profileImports(module='geocoder', top=20):
+    '''
+    Import `module` in a new interpreter with -X importtime and return
+    the `top` imports by cumulative time as (module, self seconds,
+    cumulative seconds)
+    '''
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import %s' % module],
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True)
+
+    imports = []
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            # The column header
+            continue
+
+        imports.append((fields[2].strip(), self_us / 1e6, cumulative_us / 1e6))
+
+    if result.returncode != 0:
+        raise RuntimeError('Importing %s failed:\n%s' % (module, result.stderr))
+
+    imports.sort(key=lambda i: i[2], reverse=True)
+
+    return imports[:top]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Profile how long importing a module takes.'
+    )
+
+    parser.add_argument('--module',
+                        type=str,
+                        default='geocoder',
+                        help='Module to import')
+
+    parser.add_argument('--top',
+                        type=int,
+                        default=20,
+                        help='Number of imports to show')
+
+    args = parser.parse_args()
+
+    print('%-50s %10s %12s' % ('module', 'self (s)', 'cumulative (s)'))
+    for name, self_seconds, cumulative in profileImports(args.module, args.top):
+        print('%-50s %10.4f %12.4f' % (name, self_seconds, cumulative))
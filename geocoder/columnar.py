@@ -0,0 +1,147 @@
+'''
+Parquet exports of link results and of the canonical tables, for
+analytics jobs that only need a few columns. Rows are read from a
+server side cursor and written a row group at a time, so nothing is
+ever held in memory whole.
+'''
+import os
+import logging
+
+import sqlalchemy as sa
+
+logger = logging.getLogger(__name__)
+
+# Geometry columns are exported as WKB
+GEOMETRY_COLUMNS = {'building_footprints': ['geom']}
+
+def arrowType(type_code):
+    '''
+    The Arrow type for a Postgres type OID from a psycopg2 cursor
+    description. Anything not listed is written as a string.
+    '''
+
+    import pyarrow as pa
+
+    return {16: pa.bool_(),
+            17: pa.binary(),
+            20: pa.int64(),
+            21: pa.int16(),
+            23: pa.int32(),
+            700: pa.float32(),
+            701: pa.float64(),
+            1700: pa.float64(),
+            1082: pa.date32(),
+            1114: pa.timestamp('us'),
+            1184: pa.timestamp('us', tz='UTC')}.get(type_code, pa.string())
+
+def writeQuery(engine,
+               sql,
+               path,
+               params=None,
+               batch_size=50000,
+               compression='zstd'):
+    '''
+    Write the rows of `sql` to a Parquet file at `path`, one row group
+    per `batch_size` rows, with column types taken from the query.
+    Returns the number of rows written.
+    '''
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tmp_path = '%s.tmp' % path
+
+    n_rows = 0
+
+    with engine.connect() as conn:
+        rows = conn.execution_options(stream_results=True)\
+                   .execute(sa.text(sql), **(params or {}))
+
+        description = rows.cursor.description
+
+        fields = [pa.field(column[0], arrowType(column[1])) \
+                      for column in description]
+        schema = pa.schema(fields)
+
+        string_columns = [i for i, field in enumerate(fields) \
+                              if field.type == pa.string()]
+        binary_columns = [i for i, field in enumerate(fields) \
+                              if field.type == pa.binary()]
+        # NUMERIC comes back as Decimal
+        numeric_columns = [i for i, column in enumerate(description) \
+                               if column[1] == 1700]
+
+        writer = pq.ParquetWriter(tmp_path, schema, compression=compression)
+
+        try:
+            while True:
+                batch = rows.fetchmany(batch_size)
+                if not batch:
+                    break
+
+                columns = [list(column) for column in zip(*batch)]
+                for i in string_columns:
+                    columns[i] = [None if value is None else str(value) \
+                                      for value in columns[i]]
+                for i in binary_columns:
+                    columns[i] = [None if value is None else bytes(value) \
+                                      for value in columns[i]]
+                for i in numeric_columns:
+                    columns[i] = [None if value is None else float(value) \
+                                      for value in columns[i]]
+
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+                n_rows += len(batch)
+        finally:
+            writer.close()
+
+    os.rename(tmp_path, path)
+
+    logger.info('Wrote %s rows to %s', n_rows, path)
+
+    return n_rows
+
+def exportMatches(engine, name, path, **kwargs):
+    '''
+    The matches saved by the last link of `name`, with the address id
+    and coordinates of each canonical address
+    '''
+
+    sql = '''
+        SELECT
+          t.messy_id,
+          t.canonical_id,
+          t.confidence,
+          c.address_id,
+          c.latitude,
+          c.longitude
+        FROM {0}_temp_matches AS t
+        JOIN cook_county_addresses AS c
+          ON c.id = t.canonical_id
+        ORDER BY t.messy_id, t.confidence DESC
+    '''.format(name)
+
+    return writeQuery(engine, sql, path, **kwargs)
+
+def exportTable(engine, table, path, **kwargs):
+    '''
+    Snapshot of every row of `table`
+    '''
+
+    columns = [row.column_name for row in engine.execute('''
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name = %s
+        ORDER BY ordinal_position
+    ''', (table,))]
+
+    geometry = GEOMETRY_COLUMNS.get(table, [])
+
+    select = ', '.join('ST_AsBinary({0}) AS {0}'.format(column) \
+                           if column in geometry else column \
+                           for column in columns)
+
+    sql = 'SELECT {0} FROM {1}'.format(select, table)
+
+    return writeQuery(engine, sql, path, **kwargs)
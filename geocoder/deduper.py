@@ -1,7 +1,19 @@
 import dedupe
 from dedupe import StaticGazetteer, Gazetteer
-import re
+from dedupe import core
+import numpy
 import sqlalchemy as sa
+import logging
+import time
+from collections import defaultdict, Counter, OrderedDict
+from datetime import datetime
+from geocoder.normalize import preProcess, partitionKey, placePrefixes
+from geocoder.storage import PostgresStore, hashedBlockKey, queryKeys
+from geocoder.bloom import buildBloomFilter
+from geocoder.fallback import fallbackCandidates
+from geocoder import metrics
+
+logger = logging.getLogger(__name__)
 
 class DatabaseGazetteer(Gazetteer):
     ''' 
@@ -53,20 +65,15 @@ class StaticDatabaseGazetteer(StaticGazetteer):
         
         del kwargs['engine']
 
+        self.parsed_addresses = kwargs.pop('parsed_addresses', None)
+
         super(StaticDatabaseGazetteer, self).__init__(*args, **kwargs)
+
+        if self.parsed_addresses is not None:
+            self.parsed_addresses.install(self.data_model)
     
     def preProcess(self, column):
-        if column :
-            column = str(column)
-            column = re.sub('  +', ' ', column)
-            column = re.sub('\n', ' ', column)
-            column = column.strip().strip('"').strip("'").lower().strip()
-            if not column :
-                column = ''
-        else :
-            column = ''
-
-        return column
+        return preProcess(column)
 
 
     
@@ -74,16 +81,33 @@ class StaticDatabaseGazetteer(StaticGazetteer):
                                table_to_block='cook_county_addresses', 
                                match_blocks_table='match_blocks',
                                primary_key='id',
-                               address_field='complete_address'):
+                               address_field='complete_address',
+                               packed=False,
+                               hashed=False,
+                               key_dictionary=False,
+                               bloom_filter=None,
+                               bloom_error_rate=0.01):
+        ''' 
+        With `hashed`, block keys are stored as their 64 bit hashes in a 
+        BIGINT column (see `hashedBlockKey`), which makes the table and 
+        its index much smaller. `key_dictionary` also writes the hashes 
+        and the keys they stand for to a {match_blocks_table}_keys table.
+
+        If `bloom_filter` is a path, a Bloom filter over all of the block 
+        keys, with a false positive rate of `bloom_error_rate`, is saved 
+        there.
+        '''
         
+        key_type = 'BIGINT' if hashed else 'VARCHAR'
+
         with self.engine.begin() as conn:
             conn.execute('DROP TABLE IF EXISTS {0}'.format(match_blocks_table))
             conn.execute(''' 
                 CREATE TABLE {0} (
-                    block_key VARCHAR, 
+                    block_key {2}, 
                     {1} INTEGER
                 )
-                '''.format(match_blocks_table, primary_key))
+                '''.format(match_blocks_table, primary_key, key_type))
 
         sel = ''' 
             SELECT 
@@ -94,6 +118,8 @@ class StaticDatabaseGazetteer(StaticGazetteer):
                    address_field,
                    table_to_block)
 
+        keys = set() if key_dictionary else None
+
         with self.engine.connect() as read_conn :
             rows = read_conn.execute(sel)
             data = ((row['id'], dict(row)) for row in rows) 
@@ -105,6 +131,9 @@ class StaticDatabaseGazetteer(StaticGazetteer):
                      VALUES (%s, %s)
                 '''.format(match_blocks_table, primary_key)
 
+            if hashed:
+                block_gen = self._hashBlocks(block_gen, keys)
+
             write_conn = self.engine.raw_connection()
             curs = write_conn.cursor()
 
@@ -130,10 +159,386 @@ class StaticDatabaseGazetteer(StaticGazetteer):
                   ON {0} (block_key)
             '''.format(match_blocks_table))
         
+        if key_dictionary:
+            self.createKeyDictionary(keys, match_blocks_table)
+
+        self.createBlockStatsTable(match_blocks_table)
+
+        if bloom_filter:
+            bloom = buildBloomFilter(self.engine, 
+                                     bloom_filter, 
+                                     match_blocks_table,
+                                     error_rate=bloom_error_rate)
+
+            logger.info('Saved a Bloom filter over %s block keys to %s, '
+                        '%s bits, %s hashes, expected false positive rate %f, '
+                        'measured %f',
+                        bloom.n_keys,
+                        bloom_filter,
+                        bloom.n_bits,
+                        bloom.n_hashes,
+                        bloom.expectedErrorRate(),
+                        bloom.measuredErrorRate())
+
+        if packed:
+            self.createPackedBlocksTable(table_to_block,
+                                         match_blocks_table,
+                                         primary_key,
+                                         address_field)
+
         self.engine.dispose()
 
+    def createPackedBlocksTable(self,
+                                table_to_block='cook_county_addresses', 
+                                match_blocks_table='match_blocks',
+                                primary_key='id',
+                                address_field='complete_address'):
+        ''' 
+        Materialize the block table joined to the addresses as one row 
+        per block key, holding parallel arrays of the ids and addresses 
+        in the block, so a candidate lookup reads a handful of rows by 
+        primary key instead of joining and sorting.
+        '''
+        
+        with self.engine.begin() as conn:
+            conn.execute('DROP TABLE IF EXISTS {0}_packed'.format(match_blocks_table))
+            conn.execute(''' 
+                CREATE TABLE {0}_packed AS (
+                    SELECT 
+                      blocks.block_key,
+                      array_agg(addresses.{2} ORDER BY addresses.{2}) AS ids,
+                      array_agg(addresses.{3} ORDER BY addresses.{2}) AS addresses
+                    FROM {0} AS blocks
+                    JOIN {1} AS addresses
+                      ON blocks.{2} = addresses.{2}
+                    GROUP BY blocks.block_key
+                )
+                '''.format(match_blocks_table, 
+                           table_to_block, 
+                           primary_key, 
+                           address_field))
+            conn.execute('''
+                ALTER TABLE {0}_packed ADD PRIMARY KEY (block_key)
+            '''.format(match_blocks_table))
+
+    def _hashBlocks(self, blocks, keys=None):
+        for block_key, record_id in blocks:
+            if keys is not None:
+                keys.add(block_key)
+            yield hashedBlockKey(block_key), record_id
+
+    def createPartitionedBlocksTable(self,
+                                     table_to_block='cook_county_addresses', 
+                                     match_blocks_table='match_blocks',
+                                     primary_key='id'):
+        ''' 
+        Copy the block table keyed by (partition_key, block_key), where 
+        the partition is either the zip code ('zip:60614') or the place 
+        name ('place:chicago') of the address, so a query that names 
+        either only has to search that part of the county. Every entry 
+        is in both partitions. The partitions and their sizes go into 
+        {match_blocks_table}_partitions.
+        '''
+        
+        with self.engine.begin() as conn:
+            conn.execute('DROP TABLE IF EXISTS {0}_partitioned'.format(match_blocks_table))
+            conn.execute('DROP TABLE IF EXISTS {0}_partitions'.format(match_blocks_table))
+            conn.execute(''' 
+                CREATE TABLE {0}_partitioned AS (
+                    SELECT 
+                      'zip:' || TRIM(CAST(addresses.zipcode AS VARCHAR)) AS partition_key,
+                      blocks.block_key,
+                      blocks.{2}
+                    FROM {0} AS blocks
+                    JOIN {1} AS addresses
+                      ON blocks.{2} = addresses.{2}
+                    WHERE addresses.zipcode IS NOT NULL
+                    UNION ALL
+                    SELECT 
+                      'place:' || LOWER(TRIM(addresses.usps_place_name)) AS partition_key,
+                      blocks.block_key,
+                      blocks.{2}
+                    FROM {0} AS blocks
+                    JOIN {1} AS addresses
+                      ON blocks.{2} = addresses.{2}
+                    WHERE addresses.usps_place_name IS NOT NULL
+                )
+                '''.format(match_blocks_table, table_to_block, primary_key))
+            conn.execute('''
+                CREATE INDEX {0}_partitioned_key_idx 
+                  ON {0}_partitioned (partition_key, block_key)
+            '''.format(match_blocks_table))
+            conn.execute(''' 
+                CREATE TABLE {0}_partitions AS (
+                    SELECT 
+                      partition_key, 
+                      COUNT(DISTINCT {1}) AS partition_size
+                    FROM {0}_partitioned
+                    GROUP BY partition_key
+                )
+                '''.format(match_blocks_table, primary_key))
+
+    def createKeyDictionary(self, keys, match_blocks_table='match_blocks'):
+        ''' 
+        Write the block keys behind the hashes in a hashed match blocks 
+        table, for debugging
+        '''
+
+        with self.engine.begin() as conn:
+            conn.execute('DROP TABLE IF EXISTS {0}_keys'.format(match_blocks_table))
+            conn.execute(''' 
+                CREATE TABLE {0}_keys (
+                    block_key BIGINT PRIMARY KEY, 
+                    block_key_text VARCHAR
+                )
+                '''.format(match_blocks_table))
+
+        ins = '''
+            INSERT INTO {0}_keys (block_key, block_key_text) 
+            VALUES (%s, %s)
+        '''.format(match_blocks_table)
+
+        write_conn = self.engine.raw_connection()
+        curs = write_conn.cursor()
+
+        try :
+            curs.executemany(ins, ((hashedBlockKey(key), key) for key in keys))
+            write_conn.commit()
+        except : # pragma: no cover
+            write_conn.rollback()
+            raise
+        finally :
+            curs.close()
+            write_conn.close()
+
+    def createBlockStatsTable(self, match_blocks_table='match_blocks'):
+        ''' 
+        Record how many records each block key covers so oversized 
+        blocks can be left out at query time.
+        '''
+        
+        with self.engine.begin() as conn:
+            conn.execute('DROP TABLE IF EXISTS {0}_stats'.format(match_blocks_table))
+            conn.execute(''' 
+                CREATE TABLE {0}_stats AS (
+                    SELECT 
+                      block_key, 
+                      COUNT(*) AS block_size
+                    FROM {0}
+                    GROUP BY block_key
+                )
+                '''.format(match_blocks_table))
+            conn.execute('''
+                ALTER TABLE {0}_stats ADD PRIMARY KEY (block_key)
+            '''.format(match_blocks_table))
+
+        summary = ''' 
+            SELECT
+              COUNT(*) AS block_count,
+              MAX(block_size) AS max_block_size,
+              AVG(block_size) AS mean_block_size,
+              percentile_disc(0.99) WITHIN GROUP (ORDER BY block_size) AS p99_block_size
+            FROM {0}_stats
+        '''.format(match_blocks_table)
+
+        stats = self.engine.execute(summary).first()
+
+        logger.info('%s blocks, mean size %s, 99th percentile %s, largest %s',
+                    stats.block_count, 
+                    stats.mean_block_size,
+                    stats.p99_block_size, 
+                    stats.max_block_size)
+
+        return dict(stats)
+
+    def blockingReport(self, 
+                       table_to_block='cook_county_addresses',
+                       match_blocks_table='match_blocks',
+                       primary_key='id',
+                       address_field='complete_address',
+                       messy_addresses=None,
+                       sample_size=10000,
+                       hashed_keys=False):
+        ''' 
+        Describe how each blocking predicate behaves over the canonical 
+        table: how many keys it generates, the distribution of block 
+        sizes, how many records it covers, the number of candidates an 
+        average query gets from it and how long it takes to compute. 
+        If `messy_addresses` are given, candidates per query are also 
+        measured for those. Returns a dict that can be dumped as JSON.
+
+        The predicate a key came from is read off the end of the key, so 
+        a table built with `hashed=True` needs the key dictionary 
+        (`key_dictionary=True`) to be reported on.
+        '''
+
+        predicate_id = "substring(block_key from ':([0-9]+)$')::int"
+
+        stats_table = '{0}_stats'.format(match_blocks_table)
+        blocks_table = match_blocks_table
+
+        if hashed_keys:
+            if not self.engine.has_table('{0}_keys'.format(match_blocks_table)):
+                raise ValueError('%s has hashed block keys and no %s_keys table '
+                                 'to read them from. Rebuild it with '
+                                 'key_dictionary=True' \
+                                     % (match_blocks_table, match_blocks_table))
+
+            stats_table = ''' 
+                (SELECT keys.block_key_text AS block_key, stats.block_size
+                 FROM {0}_stats AS stats
+                 JOIN {0}_keys AS keys
+                   ON stats.block_key = keys.block_key) AS stats
+            '''.format(match_blocks_table)
+
+            blocks_table = ''' 
+                (SELECT keys.block_key_text AS block_key, blocks.{1}
+                 FROM {0} AS blocks
+                 JOIN {0}_keys AS keys
+                   ON blocks.block_key = keys.block_key) AS blocks
+            '''.format(match_blocks_table, primary_key)
+
+        total_records = self.engine.execute(''' 
+            SELECT COUNT(*) AS record_count FROM {0}
+        '''.format(table_to_block)).first().record_count
+
+        report = OrderedDict()
+        for i, predicate in enumerate(self.predicates):
+            report[i] = OrderedDict([('predicate_id', i),
+                                     ('predicate', str(predicate)),
+                                     ('block_keys', 0),
+                                     ('entries', 0),
+                                     ('max_block_size', 0),
+                                     ('block_size_histogram', OrderedDict()),
+                                     ('coverage', 0.0),
+                                     ('estimated_candidates_per_query', 0.0)])
+
+        sizes = ''' 
+            SELECT 
+              {0} AS predicate_id,
+              COUNT(*) AS block_keys,
+              SUM(block_size) AS entries,
+              MAX(block_size) AS max_block_size,
+              SUM(block_size::bigint * block_size) AS sum_squares
+            FROM {1}
+            GROUP BY 1
+        '''.format(predicate_id, stats_table)
+
+        for row in self.engine.execute(sizes):
+            predicate = report[row.predicate_id]
+            predicate['block_keys'] = row.block_keys
+            predicate['entries'] = int(row.entries)
+            predicate['max_block_size'] = row.max_block_size
+            # A query that looks like a canonical record lands in a block 
+            # with probability proportional to its size
+            predicate['estimated_candidates_per_query'] = \
+                float(row.sum_squares) / total_records if total_records else 0.0
+
+        histogram = ''' 
+            SELECT
+              {0} AS predicate_id,
+              floor(log(block_size))::int AS bucket,
+              COUNT(*) AS block_keys
+            FROM {1}
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+        '''.format(predicate_id, stats_table)
+
+        for row in self.engine.execute(histogram):
+            label = '%s-%s' % (10 ** row.bucket, 10 ** (row.bucket + 1) - 1)
+            report[row.predicate_id]['block_size_histogram'][label] = row.block_keys
+
+        coverage = ''' 
+            SELECT
+              {0} AS predicate_id,
+              COUNT(DISTINCT {1}) AS covered
+            FROM {2}
+            GROUP BY 1
+        '''.format(predicate_id, primary_key, blocks_table)
+
+        for row in self.engine.execute(coverage):
+            report[row.predicate_id]['coverage'] = \
+                float(row.covered) / total_records if total_records else 0.0
+
+        sample = ''' 
+            SELECT {0} AS id, {1} AS complete_address
+            FROM {2}
+            WHERE {1} IS NOT NULL
+            ORDER BY RANDOM()
+            LIMIT :sample_size
+        '''.format(primary_key, address_field, table_to_block)
+
+        records = [(row.id, {'complete_address': row.complete_address}) \
+                       for row in self.engine.execute(sa.text(sample), 
+                                                      sample_size=sample_size)]
+
+        for i, predicate in enumerate(self.predicates):
+            start = time.time()
+            for _, record in records:
+                predicate(record)
+            elapsed = time.time() - start
+
+            report[i]['seconds_per_1000_records'] = \
+                1000 * elapsed / len(records) if records else 0.0
+
+        if messy_addresses:
+            self._messyCandidateReport(report, 
+                                       messy_addresses, 
+                                       match_blocks_table,
+                                       hashed_keys)
+
+        return OrderedDict([('generated', datetime.now().isoformat()),
+                            ('table', table_to_block),
+                            ('match_blocks_table', match_blocks_table),
+                            ('records', total_records),
+                            ('timing_sample_size', len(records)),
+                            ('predicates', list(report.values()))])
+
+    def _messyCandidateReport(self, 
+                              report, 
+                              messy_addresses, 
+                              match_blocks_table,
+                              hashed_keys=False):
+        messy_records = [(idx, {'complete_address': self.preProcess(address)}) \
+                             for idx, address in enumerate(messy_addresses)]
+
+        messy_keys = list(self.blocker(messy_records))
+
+        sel = ''' 
+            SELECT block_key, block_size
+            FROM {0}_stats
+            WHERE block_key IN :block_keys
+        '''.format(match_blocks_table)
+
+        block_sizes = {}
+        keys = queryKeys({block_key for block_key, _ in messy_keys}, hashed_keys)
+        all_keys = list(keys)
+        for i in range(0, len(all_keys), 10000):
+            rows = self.engine.execute(sa.text(sel), 
+                                       block_keys=tuple(all_keys[i:i + 10000]))
+            block_sizes.update((keys[row.block_key], row.block_size) for row in rows)
+
+        candidates = Counter()
+        for block_key, _ in messy_keys:
+            candidates[int(block_key.rsplit(':', 1)[1])] += block_sizes.get(block_key, 0)
+
+        for predicate_id, predicate in report.items():
+            predicate['messy_candidates_per_query'] = \
+                float(candidates[predicate_id]) / len(messy_records)
+
 class AddressLinkGazetteer(StaticDatabaseGazetteer):
     
+    ''' 
+    Set `hashed_keys` when match_blocks was built with `hashed=True`. 
+    The messy block table can then hold either hashed or plain keys.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        
+        self.hashed_keys = kwargs.pop('hashed_keys', False)
+
+        super(AddressLinkGazetteer, self).__init__(*args, **kwargs)
+
     def _blockData(self, messy_data):
 
         ''' 
@@ -184,8 +589,13 @@ class AddressLinkGazetteer(StaticDatabaseGazetteer):
 
             A = [(messy_record.blocked_record_id, record, set())]
             
+            block_keys = messy_record.block_keys
+            if self.hashed_keys:
+                block_keys = [hashedBlockKey(key) if isinstance(key, str) else key \
+                                  for key in block_keys]
+
             rows = self.engine.execute(sa.text(canon_blocks), 
-                                       block_keys=tuple(messy_record.block_keys))
+                                       block_keys=tuple(block_keys))
 
             B = [(row.id, row, set()) for row in rows]
 
@@ -195,38 +605,426 @@ class AddressLinkGazetteer(StaticDatabaseGazetteer):
 
 class GeocodingGazetteer(StaticDatabaseGazetteer):
     
+    ''' 
+    Candidates and canonical records are read through `store`, which 
+    defaults to a PostgresStore on `engine`; pass a SQLiteStore to match 
+    against an embedded copy of the tables instead.
+
+    `max_block_size` leaves out block keys covering more canonical 
+    records than that and `max_candidates` keeps only that many 
+    candidates per messy record, ranked by how many block keys they 
+    share with it.
+
+    When `record_columns` is set, candidates are fetched with those 
+    columns so that `matchBatch` can hand back the matched records 
+    without going back to the store.
+
+    Block keys missing from `bloom_filter`, a BloomFilter over the block 
+    table, are dropped before looking up candidates, and the lookup is 
+    skipped when no keys are left.
+
+    `fallback_candidates` turns on a trigram similarity lookup, giving 
+    addresses that blocking finds no candidates for up to that many 
+    candidates with the most similar canonical addresses.
+
+    `partitions` is the set of partition keys of the partitioned block 
+    table. When it is given, addresses that name one of them are only 
+    matched against canonical addresses in that partition, and against 
+    the whole county if that finds nothing.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        
+        store = kwargs.pop('store', None)
+        self.max_block_size = kwargs.pop('max_block_size', None)
+        self.max_candidates = kwargs.pop('max_candidates', None)
+        self.record_columns = kwargs.pop('record_columns', None)
+        self.bloom_filter = kwargs.pop('bloom_filter', None)
+        self.partitions = kwargs.pop('partitions', None)
+        self.place_prefixes = placePrefixes(self.partitions or ())
+        self.fallback_candidates = kwargs.pop('fallback_candidates', None)
+        
+        kwargs.setdefault('engine', None)
+
+        super(GeocodingGazetteer, self).__init__(*args, **kwargs)
+
+        self.store = store or PostgresStore(self.engine)
+
+        self.oversized_blocks = {}
+        
+        if self.max_block_size:
+            self.oversized_blocks = self.store.oversizedBlocks(self.max_block_size)
+
+    def pruneBlockKeys(self, keys):
+        ''' 
+        Drop oversized block keys. If every key of a record is oversized, 
+        keep only the smallest one so the record still gets candidates.
+        '''
+
+        oversized = [key for key in keys if key in self.oversized_blocks]
+
+        if not oversized:
+            return keys
+
+        if len(oversized) == len(keys):
+            return {min(oversized, key=self.oversized_blocks.get)}
+
+        return keys.difference(oversized)
+
     def _blockData(self, messy_data):
         
-        address = self.preProcess(messy_data['complete_address'])
+        addresses = [messy_data['complete_address']]
+
+        messy_records, block_keys = self.blockKeys(addresses)
         
-        record = {'complete_address': address}
+        candidates = self.candidates(block_keys, self.partitionAddresses(addresses))
+
+        self.addFallbackCandidates(messy_records, candidates)
         
-        block_keys = {b[0] for b in \
-            list(self.blocker([('messy', record)]))}
+        for messy_id, record in messy_records:
+            A = [(messy_id, record, set())]
+            B = [(canon_id, canon_record, set()) \
+                    for canon_id, canon_record in candidates.get(messy_id, [])]
+            
+            if B:
+                yield (A,B)
 
-        # Distinct by record id where records exist in entity_map
-        sel = ''' 
+    def blockKeys(self, addresses, timings=None):
+        ''' 
+        Preprocess a list of messy addresses and block them all in one 
+        pass. Returns the messy records, keyed by their position in 
+        `addresses`, and a dict of the block keys for each position. 
+        If a `timings` dict is passed in, the seconds spent preprocessing 
+        and blocking are added to it.
+        '''
+
+        start = time.time()
+
+        messy_records = [(idx, {'complete_address': self.preProcess(address)}) \
+                             for idx, address in enumerate(addresses)]
+
+        blocking_start = time.time()
+
+        block_keys = defaultdict(set)
+        for block_key, idx in self.blocker(messy_records):
+            block_keys[idx].add(block_key)
+
+        if timings is not None:
+            timings['preprocess'] = blocking_start - start
+            timings['blocking'] = time.time() - blocking_start
+
+        return messy_records, block_keys
+
+    def partitionAddresses(self, addresses):
+        ''' 
+        Dict of the partition to search for each position in `addresses` 
+        that names one
+        '''
+
+        if not self.partitions:
+            return {}
+
+        partitions = {}
+        for idx, address in enumerate(addresses):
+            partition = partitionKey(address, self.partitions, self.place_prefixes)
+            if partition:
+                partitions[idx] = partition
+
+        return partitions
+
+    def candidates(self, block_keys, partitions=None):
+        ''' 
+        Fetch the canonical records covered by any of the block keys of 
+        any messy record in one lookup and hand each messy record back 
+        the candidates that share a block key with it. Messy records 
+        with an entry in `partitions` are first looked up in that 
+        partition only, one lookup per partition.
+        '''
+
+        if self.bloom_filter is not None:
+            block_keys = self.bloom_filter.filterKeys(block_keys)
+
+        candidates = {}
+
+        if partitions:
+            candidates = self.partitionCandidates(block_keys, partitions)
+            block_keys = {messy_id: keys for messy_id, keys in block_keys.items() \
+                              if messy_id not in candidates}
+
+        block_keys, all_keys = self.lookupKeys(block_keys, filter_keys=False)
+
+        if all_keys:
+            blocked_records = self.store.blockedRecords(all_keys, 
+                                                        self.record_columns)
+
+            candidates.update(self.groupCandidates(block_keys, blocked_records))
+
+        return candidates
+
+    def partitionCandidates(self, block_keys, partitions):
+        by_partition = defaultdict(dict)
+        for messy_id, keys in block_keys.items():
+            if messy_id in partitions and keys:
+                by_partition[partitions[messy_id]][messy_id] = keys
+
+        candidates = {}
+        for partition, partition_keys in by_partition.items():
+            partition_keys, all_keys = self.lookupKeys(partition_keys, 
+                                                       filter_keys=False)
+
+            blocked_records = self.store.blockedRecords(all_keys, 
+                                                        self.record_columns,
+                                                        partition=partition)
+
+            candidates.update(self.groupCandidates(partition_keys, blocked_records))
+
+        return candidates
+
+    def addFallbackCandidates(self, messy_records, candidates):
+        ''' 
+        Look up similar addresses for the messy records that blocking 
+        found no candidates for. Returns how many got some.
+        '''
+
+        if not self.fallback_candidates:
+            return 0
+
+        return fallbackCandidates(self.store, 
+                                  messy_records, 
+                                  candidates, 
+                                  self.fallback_candidates,
+                                  self.record_columns)
+
+    def lookupKeys(self, block_keys, filter_keys=True):
+        ''' 
+        Prune the block keys of each messy record and return them along 
+        with the set of all keys that need to be looked up
+        '''
+
+        if filter_keys and self.bloom_filter is not None:
+            block_keys = self.bloom_filter.filterKeys(block_keys)
+
+        if self.oversized_blocks:
+            block_keys = {messy_id: self.pruneBlockKeys(keys) \
+                              for messy_id, keys in block_keys.items()}
+
+        all_keys = set()
+        for keys in block_keys.values():
+            all_keys.update(keys)
+
+        return block_keys, all_keys
+
+    def groupCandidates(self, block_keys, blocked_records):
+        ''' 
+        Split (block_key, id, record) rows back up by messy record, 
+        keeping the best ranked candidates for each
+        '''
+
+        blocks = defaultdict(set)
+        records = {}
+        
+        for block_key, canon_id, record in blocked_records:
+            blocks[block_key].add(canon_id)
+            if canon_id not in records:
+                records[canon_id] = record
+
+        candidates = {}
+        for messy_id, keys in block_keys.items():
+            shared_keys = Counter()
+            for key in keys:
+                shared_keys.update(blocks.get(key, ()))
+
+            if self.max_candidates and len(shared_keys) > self.max_candidates:
+                canon_ids = sorted(shared_keys, 
+                                   key=lambda canon_id: (-shared_keys[canon_id], 
+                                                         canon_id))
+                canon_ids = canon_ids[:self.max_candidates]
+            else:
+                canon_ids = sorted(shared_keys)
+
+            if canon_ids:
+                candidates[messy_id] = [(canon_id, records[canon_id]) \
+                                            for canon_id in canon_ids]
+        
+        return candidates
+
+    def scoreCandidates(self, messy_records, candidates, threshold=0.5, n_matches=1):
+        ''' 
+        Score every (messy, candidate) pair of a batch with one set of 
+        field distance computations and one call to the classifier, then 
+        split the scores back up by messy record. Returns a list, in the 
+        order of `messy_records`, of up to `n_matches` (canonical id, 
+        score) tuples above `threshold`, best first.
+        '''
+
+        record_pairs = []
+        canon_ids = []
+        bounds = []
+
+        for messy_id, record in messy_records:
+            start = len(record_pairs)
+            for canon_id, canon_record in candidates.get(messy_id, []):
+                record_pairs.append((record, canon_record))
+                canon_ids.append(canon_id)
+            bounds.append((start, len(record_pairs)))
+
+        if not record_pairs:
+            return [[] for _ in messy_records]
+
+        if self.parsed_addresses is not None:
+            self.parsed_addresses.prefetch(canon_record['complete_address'] \
+                                               for _, canon_record in record_pairs)
+        
+        distances = core.fieldDistances(record_pairs, self.data_model)
+        scores = core.scorePairs(distances, self.data_model)
+
+        results = []
+        for start, stop in bounds:
+            block_scores = scores[start:stop]
+            best = numpy.argsort(-block_scores)[:n_matches]
+            results.append([(canon_ids[start + i], float(block_scores[i])) \
+                                for i in best if block_scores[i] > threshold])
+
+        return results
+
+    def matchedRecords(self, candidates, results, records):
+        ''' 
+        Copy the candidate records of every match in `results` into the 
+        `records` dict, if the candidates carry `record_columns`
+        '''
+
+        if not self.record_columns:
+            return
+
+        for messy_id, matches in enumerate(results):
+            if not matches:
+                continue
+            candidate_records = dict(candidates[messy_id])
+            for canon_id, _ in matches:
+                records[canon_id] = candidate_records[canon_id]
+
+    def matchBatch(self, 
+                   addresses, 
+                   threshold=0.5, 
+                   n_matches=1, 
+                   stats=None, 
+                   records=None):
+        ''' 
+        Match a list of messy address strings. Returns a list of matches 
+        per address as described in `scoreCandidates`. If a `stats` dict 
+        is passed in, it is filled in with the size and timings of the 
+        batch. If a `records` dict is passed in and `record_columns` is 
+        set, it is filled in with the matched canonical records.
+        '''
+
+        start = time.time()
+        timings = OrderedDict()
+
+        messy_records, block_keys = self.blockKeys(addresses, timings)
+
+        candidates_start = time.time()
+        candidates = self.candidates(block_keys, self.partitionAddresses(addresses))
+
+        fallback_start = time.time()
+        n_fallback = self.addFallbackCandidates(messy_records, candidates)
+
+        scoring_start = time.time()
+        results = self.scoreCandidates(messy_records, 
+                                       candidates, 
+                                       threshold=threshold, 
+                                       n_matches=n_matches)
+        end = time.time()
+
+        n_pairs = sum(len(c) for c in candidates.values())
+        scoring_time = end - scoring_start
+
+        timings['candidates'] = fallback_start - candidates_start
+        if self.fallback_candidates:
+            timings['fallback'] = scoring_start - fallback_start
+        timings['scoring'] = scoring_time
+
+        metrics.observeStages(timings)
+        for messy_id, _ in messy_records:
+            metrics.candidates_per_address.observe(len(candidates.get(messy_id, ())))
+
+        batch_stats = {
+            'records': len(addresses),
+            'pairs': n_pairs,
+            'seconds': end - start,
+            'scoring_seconds': scoring_time,
+            'pairs_per_second': n_pairs / scoring_time if scoring_time else 0.0,
+            'fallback_records': n_fallback,
+            'timings': timings,
+        }
+
+        logger.info('Scored %(pairs)s pairs for %(records)s records '
+                    'in %(scoring_seconds)f seconds', batch_stats)
+
+        if stats is not None:
+            stats.update(batch_stats)
+
+        if records is not None:
+            self.matchedRecords(candidates, results, records)
+
+        return results
+
+class FootprintLinkGazetteer(StaticDatabaseGazetteer):
+    
+    def _blockData(self, messy_data):
+
+        ''' 
+        `messy_data` should be a dict like so:
+
+        {
+            'footprint_ids': [<id>, <id>, ...],
+            'tolerance': <degrees>,
+        }
+
+        Candidates for each footprint are the canonical addresses 
+        whose point falls inside the footprint or within `tolerance` 
+        degrees of it, so the classifier only ever scores a handful 
+        of nearby addresses instead of the whole county.
+        '''
+
+        tolerance = messy_data.get('tolerance', 0.0002)
+        
+        # The point expression has to match the one in the GIST index 
+        # created by linkFootprints.createPointIndex so Postgres uses it
+        candidates = ''' 
             SELECT
-              DISTINCT ON (addresses.id)
+              footprints.id AS footprint_id,
+              footprints.complete_address AS footprint_address,
               addresses.id,
               addresses.complete_address
-            FROM cook_county_addresses AS addresses
-            JOIN match_blocks AS blocks
-              USING(id)
-            WHERE blocks.block_key IN :block_keys
-            ORDER BY addresses.id
+            FROM building_footprints AS footprints
+            JOIN cook_county_addresses AS addresses
+              ON ST_DWithin(footprints.geom, 
+                            ST_SetSRID(ST_MakePoint(addresses.longitude, 
+                                                    addresses.latitude), 4326),
+                            :tolerance)
+            WHERE footprints.id IN :footprint_ids
+              AND addresses.complete_address IS NOT NULL
+            ORDER BY footprints.id
         '''
-        
-        B = []
 
-        local_engine = self.engine.execute
+        rows = self.engine.execute(sa.text(candidates),
+                                   footprint_ids=tuple(messy_data['footprint_ids']),
+                                   tolerance=tolerance)
 
-        A = [('messy', record, set())]
-        rows = local_engine(sa.text(sel), 
-                block_keys=tuple(block_keys),
-                state='accepted')
-        B = [(row.id, row, set()) for row in rows]
-        
-        if B:
-            yield (A,B)
+        footprint_id = None
+        A, B = [], []
 
+        for row in rows:
+            if row.footprint_id != footprint_id:
+                if B:
+                    yield (A, B)
+                
+                footprint_id = row.footprint_id
+                record = {'complete_address': self.preProcess(row.footprint_address)}
+                A = [(footprint_id, record, set())]
+                B = []
+            
+            B.append((row.id, row, set()))
+
+        if B:
+            yield (A, B)
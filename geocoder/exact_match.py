@@ -0,0 +1,115 @@
+from geocoder.normalize import normalizeAddress, addressVariants
+
+def createExactMatchTable(engine,
+                          table_to_index='cook_county_addresses',
+                          exact_match_table='exact_match_addresses',
+                          primary_key='id'):
+    '''
+    Build a lookup from every normalized variant of each canonical
+    address to its id so that inputs which are already canonical can
+    skip blocking and scoring altogether.
+    '''
+
+    with engine.begin() as conn:
+        conn.execute('DROP TABLE IF EXISTS {0}'.format(exact_match_table))
+        conn.execute('''
+            CREATE TABLE {0} (
+                address_key VARCHAR,
+                {1} INTEGER
+            )
+            '''.format(exact_match_table, primary_key))
+
+    sel = '''
+        SELECT
+          {0} AS id,
+          complete_address,
+          complete_street_address,
+          usps_place_name,
+          usps_state
+        FROM {1}
+        WHERE complete_address IS NOT NULL
+    '''.format(primary_key, table_to_index)
+
+    with engine.connect() as read_conn :
+        rows = read_conn.execute(sel)
+
+        ins = '''
+            INSERT INTO {0}
+                 (address_key, {1})
+                 VALUES (%s, %s)
+            '''.format(exact_match_table, primary_key)
+
+        write_conn = engine.raw_connection()
+        curs = write_conn.cursor()
+
+        try :
+            for row in rows :
+                for key in addressVariants(row) :
+                    curs.execute(ins, (key, row.id))
+            write_conn.commit()
+        except : # pragma: no cover
+            write_conn.rollback()
+            raise
+        finally :
+            curs.close()
+            write_conn.close()
+
+    with engine.begin() as conn:
+        conn.execute('''
+            DROP INDEX IF EXISTS {0}_key_idx
+        '''.format(exact_match_table))
+
+    with engine.begin() as conn:
+        conn.execute('''
+            CREATE INDEX {0}_key_idx
+              ON {0} (address_key)
+        '''.format(exact_match_table))
+
+def addressKeys(addresses):
+    '''
+    Map the exact match key of each address to the positions in
+    `addresses` it came from
+    '''
+
+    address_keys = {}
+    for idx, address in enumerate(addresses):
+        address_key = normalizeAddress(address)
+        if address_key:
+            address_keys.setdefault(address_key, []).append(idx)
+
+    return address_keys
+
+def uniqueMatches(address_keys, ids):
+    '''
+    Turn the ids found for each key into a dict from the position of
+    each address to its canonical id, leaving out ambiguous keys
+    '''
+
+    matches = {}
+    for address_key, canon_ids in ids.items():
+        if len(canon_ids) == 1:
+            canon_id = next(iter(canon_ids))
+            for idx in address_keys[address_key]:
+                matches[idx] = canon_id
+
+    return matches
+
+def exactMatches(store, addresses):
+    '''
+    Look up a list of addresses in one query. Returns a dict from the
+    position of each address in `addresses` to the id of the canonical
+    address it normalizes to. Addresses that normalize to nothing or to
+    more than one canonical address are left out.
+    '''
+
+    address_keys = addressKeys(addresses)
+
+    return uniqueMatches(address_keys, store.exactMatchIds(list(address_keys)))
+
+def exactMatch(store, address):
+    '''
+    Return the id of the canonical address `address` normalizes to, or
+    None if there isn't exactly one.
+    '''
+
+    return exactMatches(store, [address]).get(0)
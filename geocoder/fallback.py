@@ -0,0 +1,65 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+ADDRESS_NUMBER = re.compile(r'^(\d+)\s')
+
+def createTrigramIndex(engine,
+                       table='cook_county_addresses',
+                       address_field='complete_address'):
+    '''
+    Index the canonical addresses with pg_trgm so addresses that no
+    blocking predicate covers, say because of a misspelled street name,
+    can still get candidates by trigram similarity.
+    '''
+
+    with engine.begin() as conn:
+        conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        conn.execute('DROP INDEX IF EXISTS {0}_{1}_trgm_idx'.format(table, address_field))
+        conn.execute('''
+            CREATE INDEX {0}_{1}_trgm_idx
+              ON {0} USING gin ({1} gin_trgm_ops)
+        '''.format(table, address_field))
+
+def addressNumber(address):
+    '''
+    The house number an address starts with, if any
+    '''
+
+    match = ADDRESS_NUMBER.match(address)
+
+    if match:
+        return match.group(1)
+
+def fallbackCandidates(store, messy_records, candidates, budget, columns=None):
+    '''
+    Give every messy record that blocking found no candidates for up to
+    `budget` canonical records with the most similar addresses,
+    restricted to the same house number when it has one. The records
+    of a whole batch are looked up in one query, so a batch with many
+    misses waits on the fallback once rather than once per miss. Adds
+    them to `candidates` and returns how many records got fallback
+    candidates.
+    '''
+
+    misses = [(messy_id, record['complete_address']) \
+                  for messy_id, record in messy_records \
+                  if messy_id not in candidates and record['complete_address']]
+
+    if not misses:
+        return 0
+
+    similar = store.similarRecords([(address, addressNumber(address)) \
+                                        for _, address in misses],
+                                   budget,
+                                   columns)
+
+    found = 0
+
+    for (messy_id, _), records in zip(misses, similar):
+        if records:
+            candidates[messy_id] = records
+            found += 1
+
+    return found
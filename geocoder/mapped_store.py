@@ -0,0 +1,314 @@
+import os
+import mmap
+import json
+import struct
+from collections import OrderedDict
+
+import numpy
+
+from geocoder.storage import RECORD_COLUMNS, projection, blockKeyHash, HashedKeys
+
+MAGIC = b'GEOMMAP1'
+VERSION = 1
+
+# String columns of cook_county_addresses copied into the map. Numeric
+# columns are kept as fixed width arrays.
+STRING_COLUMNS = ('complete_address',
+                  'address_id',
+                  'complete_street_address',
+                  'usps_place_name',
+                  'usps_state',
+                  'zipcode')
+
+FLOAT_COLUMNS = ('latitude', 'longitude')
+
+class MappedStore(object):
+    '''
+    Canonical addresses, block index and exact match index read from
+    one read only file that every worker process maps into memory, so
+    the pages are shared and opening the store costs almost nothing.
+    Built by `exportMapped`.
+
+    Records only carry the columns in STRING_COLUMNS and FLOAT_COLUMNS
+    plus the id; other `columns` are left out.
+    '''
+
+    def __init__(self, path, columns=RECORD_COLUMNS):
+        self.path = path
+        self.columns = self._available(columns)
+
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a mapped geocoder store' % path)
+
+        header_length, = struct.unpack('<Q', self.map[8:16])
+        self.header = json.loads(self.map[16:16 + header_length].decode('utf-8'))
+
+        if self.header['version'] != VERSION:
+            raise ValueError('%s was built by an incompatible version' % path)
+
+        self.sections = {}
+        for name, section in self.header['sections'].items():
+            self.sections[name] = numpy.frombuffer(self.map,
+                                                   dtype=section['dtype'],
+                                                   count=section['count'],
+                                                   offset=section['offset'])
+
+        self.ids = self.sections['ids']
+
+    def _available(self, columns):
+        return tuple(c for c in projection(columns) \
+                         if c == 'id' or c in STRING_COLUMNS or c in FLOAT_COLUMNS)
+
+    def _record(self, row, columns):
+        record = OrderedDict()
+
+        for column in columns:
+            if column == 'id':
+                record[column] = int(self.ids[row])
+            elif column in STRING_COLUMNS:
+                record[column] = self._string(column, row)
+            else:
+                value = float(self.sections[column][row])
+                record[column] = None if numpy.isnan(value) else value
+
+        return record
+
+    def _string(self, column, row):
+        offsets = self.sections['%s_offsets' % column]
+        data = self.sections['%s_data' % column]
+
+        value = data[offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+        return value or None
+
+    def _postings(self, index, keys):
+        hashes = self.sections['%s_hashes' % index]
+        offsets = self.sections['%s_offsets' % index]
+        rows = self.sections['%s_rows' % index]
+
+        for key in keys:
+            key_hash = blockKeyHash(key)
+            i = numpy.searchsorted(hashes, key_hash)
+            if i < len(hashes) and hashes[i] == key_hash:
+                yield key, rows[offsets[i]:offsets[i + 1]]
+
+    def _rows(self, ids):
+        ids = numpy.asarray(sorted(ids), dtype='int64')
+        rows = numpy.searchsorted(self.ids, ids)
+
+        found = rows < len(self.ids)
+        found[found] = self.ids[rows[found]] == ids[found]
+
+        return rows[found]
+
+    def blockedRecords(self, block_keys, columns=None):
+        columns = self._available(columns)
+
+        for block_key, rows in self._postings('block', block_keys):
+            for row in rows:
+                yield (block_key,
+                       int(self.ids[row]),
+                       self._record(row, columns))
+
+    def oversizedBlocks(self, max_block_size):
+        hashes = self.sections['block_hashes']
+        sizes = numpy.diff(self.sections['block_offsets'])
+        oversized = sizes > max_block_size
+
+        return HashedKeys({int(h): int(size) for h, size \
+                               in zip(hashes[oversized], sizes[oversized])})
+
+    def records(self, ids):
+        records = {}
+
+        for row in self._rows(ids):
+            records[int(self.ids[row])] = self._record(row, self.columns)
+
+        return records
+
+    def exactMatchIds(self, address_keys):
+        ids = {}
+
+        for address_key, rows in self._postings('exact', address_keys):
+            ids[address_key] = {int(self.ids[row]) for row in rows}
+
+        return ids
+
+
+def postings(key_hashes, rows):
+    '''
+    Sort (hash, row) pairs and collapse them into sorted unique hashes,
+    an offsets table into the rows array and the rows themselves
+    '''
+
+    key_hashes = numpy.asarray(key_hashes, dtype='uint64')
+    rows = numpy.asarray(rows, dtype='uint32')
+
+    order = numpy.lexsort((rows, key_hashes))
+    key_hashes, rows = key_hashes[order], rows[order]
+
+    unique_hashes, starts = numpy.unique(key_hashes, return_index=True)
+    offsets = numpy.append(starts, len(rows)).astype('uint64')
+
+    return unique_hashes, offsets, rows
+
+def stringColumn(values):
+    offsets = [0]
+    data = bytearray()
+
+    for value in values:
+        if value is not None:
+            data.extend(str(value).encode('utf-8'))
+        offsets.append(len(data))
+
+    return (numpy.array(offsets, dtype='uint64'),
+            numpy.frombuffer(bytes(data), dtype='uint8'))
+
+def writeMapped(path, sections):
+    '''
+    Write named numpy arrays into one file: a magic number, the length
+    of a JSON header describing where each array lives, the header and
+    then every array, 8 byte aligned
+    '''
+
+    def align(n):
+        return (n + 7) // 8 * 8
+
+    layout = OrderedDict()
+    header = {'version': VERSION, 'sections': layout}
+
+    # The header's own size moves the data offsets, so grow the space 
+    # left for it until the header fits in front of the data
+    data_start = 16
+    while True:
+        offset = data_start
+        for name, array in sections.items():
+            layout[name] = {'dtype': array.dtype.str,
+                            'count': int(array.size),
+                            'offset': offset}
+            offset = align(offset + array.nbytes)
+
+        header_bytes = json.dumps(header).encode('utf-8')
+
+        if 16 + len(header_bytes) <= data_start:
+            break
+
+        data_start = align(16 + len(header_bytes) + 64)
+
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in sections.items():
+            f.write(b'\0' * (layout[name]['offset'] - f.tell()))
+            f.write(array.tobytes())
+
+    os.rename(tmp_path, path)
+
+def fetchChunks(engine, sql, batch_size):
+    '''
+    Yields the rows of `sql` `batch_size` at a time from a server side
+    cursor, so the whole result is never held in memory
+    '''
+
+    with engine.connect() as conn:
+        rows = conn.execution_options(stream_results=True).execute(sql)
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                break
+            yield batch
+
+def keyHash(key):
+    # Tables built with hashed keys already hold the hash, signed to fit
+    # a BIGINT
+    if isinstance(key, int):
+        return key % (1 << 64)
+    return blockKeyHash(key)
+
+def exportMapped(engine, path, batch_size=50000):
+    '''
+    Build a MappedStore file from cook_county_addresses, match_blocks
+    and, if it exists, exact_match_addresses. Rows are read in chunks of
+    `batch_size` and packed into arrays as they arrive.
+    '''
+
+    columns = ('id',) + STRING_COLUMNS + FLOAT_COLUMNS
+
+    sel = '''
+        SELECT {0}
+        FROM cook_county_addresses
+        ORDER BY id
+    '''.format(', '.join(columns))
+
+    chunks = {column: [] for column in ('id',) + FLOAT_COLUMNS}
+    string_offsets = {column: [numpy.zeros(1, dtype='uint64')] \
+                          for column in STRING_COLUMNS}
+    string_data = {column: [] for column in STRING_COLUMNS}
+    string_sizes = {column: 0 for column in STRING_COLUMNS}
+
+    for batch in fetchChunks(engine, sel, batch_size):
+        values = dict(zip(columns, zip(*batch)))
+
+        chunks['id'].append(numpy.array(values['id'], dtype='int64'))
+
+        for column in FLOAT_COLUMNS:
+            chunks[column].append(numpy.array([numpy.nan if v is None else v \
+                                                   for v in values[column]],
+                                              dtype='float64'))
+
+        for column in STRING_COLUMNS:
+            offsets, data = stringColumn(values[column])
+            string_offsets[column].append(offsets[1:] \
+                                              + numpy.uint64(string_sizes[column]))
+            string_data[column].append(data)
+            string_sizes[column] += len(data)
+
+    sections = OrderedDict()
+    sections['ids'] = numpy.concatenate(chunks.pop('id') \
+                                            or [numpy.zeros(0, dtype='int64')])
+
+    for column in FLOAT_COLUMNS:
+        sections[column] = numpy.concatenate(chunks.pop(column) \
+                                                 or [numpy.zeros(0, dtype='float64')])
+
+    for column in STRING_COLUMNS:
+        sections['%s_offsets' % column] = numpy.concatenate(string_offsets.pop(column))
+        sections['%s_data' % column] = numpy.concatenate(string_data.pop(column) \
+                                                             or [numpy.zeros(0, dtype='uint8')])
+
+    indexes = [('block', 'match_blocks', 'block_key'),
+               ('exact', 'exact_match_addresses', 'address_key')]
+
+    for index, table, key_column in indexes:
+        hash_chunks = [numpy.zeros(0, dtype='uint64')]
+        id_chunks = [numpy.zeros(0, dtype='int64')]
+
+        if engine.has_table(table):
+            sel = 'SELECT {0}, id FROM {1}'.format(key_column, table)
+            for batch in fetchChunks(engine, sel, batch_size):
+                hash_chunks.append(numpy.array([keyHash(key) for key, _ in batch],
+                                               dtype='uint64'))
+                id_chunks.append(numpy.array([canon_id for _, canon_id in batch],
+                                             dtype='int64'))
+
+        key_hashes = numpy.concatenate(hash_chunks)
+        canon_ids = numpy.concatenate(id_chunks)
+        del hash_chunks, id_chunks
+
+        rows = numpy.searchsorted(sections['ids'], canon_ids)
+
+        # Leave out entries for ids that are no longer in the table
+        found = rows < len(sections['ids'])
+        found[found] = sections['ids'][rows[found]] == canon_ids[found]
+
+        hashes, offsets, rows = postings(key_hashes[found], rows[found])
+        sections['%s_hashes' % index] = hashes
+        sections['%s_offsets' % index] = offsets
+        sections['%s_rows' % index] = rows
+
+    writeMapped(path, sections)
@@ -0,0 +1,149 @@
+'''
+Per process counters and histograms rendered in the Prometheus text
+exposition format by /metrics.
+'''
+import threading
+from collections import OrderedDict
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CANDIDATE_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+def formatLabels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('"', '\\"')) \
+                                 for name, value in labels)
+
+def formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter(object):
+
+    kind = 'counter'
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.lock = threading.Lock()
+        self.values = OrderedDict()
+
+    def inc(self, value=1, label_value=None):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + value
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+
+        for label_value, value in values:
+            labels = [(self.label, label_value)] if self.label else []
+            yield self.name, labels, value
+
+
+class Histogram(object):
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.lock = threading.Lock()
+        self.values = OrderedDict()
+
+    def observe(self, value, label_value=None):
+        with self.lock:
+            counts, total = self.values.get(label_value, ([0] * len(self.buckets), 0.0))
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+
+            self.values[label_value] = (counts, total + value)
+
+    def samples(self):
+        with self.lock:
+            values = [(label_value, list(counts), total) \
+                          for label_value, (counts, total) in self.values.items()]
+
+        for label_value, counts, total in values:
+            labels = [(self.label, label_value)] if self.label else []
+
+            for bound, count in zip(self.buckets, counts):
+                yield ('%s_bucket' % self.name,
+                       labels + [('le', formatValue(bound))],
+                       count)
+
+            yield '%s_sum' % self.name, labels, total
+            yield '%s_count' % self.name, labels, counts[-1]
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, label=None):
+        metric = Counter(name, help, label)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=STAGE_BUCKETS, label=None):
+        metric = Histogram(name, help, buckets, label)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, gauges=()):
+        '''
+        Text exposition of every metric plus `gauges`, a list of
+        (name, help, [(labels, value), ...]) read at scrape time
+        '''
+
+        lines = []
+
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, formatLabels(labels), formatValue(value)))
+
+        for name, help, values in gauges:
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s gauge' % name)
+            for labels, value in values:
+                if value is None:
+                    continue
+                lines.append('%s%s %s' % (name, formatLabels(labels), formatValue(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+requests_total = registry.counter('geocoder_requests_total',
+                                  'Requests handled, by endpoint',
+                                  label='endpoint')
+
+stage_seconds = registry.histogram('geocoder_stage_seconds',
+                                   'Time spent in each stage of a geocode request',
+                                   label='stage')
+
+candidates_per_address = registry.histogram('geocoder_candidates_per_address',
+                                            'Candidates scored for each address sent to dedupe',
+                                            buckets=CANDIDATE_BUCKETS)
+
+def observeStages(timings):
+    '''
+    Record a dict of stage name to seconds
+    '''
+
+    for stage, seconds in timings.items():
+        stage_seconds.observe(seconds, stage)
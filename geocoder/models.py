@@ -0,0 +1,250 @@
+import os
+import time
+import logging
+import threading
+from collections import namedtuple
+
+from geocoder.storage import PostgresStore, SQLiteStore, RECORD_COLUMNS
+from geocoder import metrics, coldstart
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_FILE = os.path.abspath(
+                    os.path.join(
+                        os.path.dirname(__file__),
+                        'data',
+                        'dedupe.settings'))
+
+Models = namedtuple('Models', ['matcher', 'store', 'version', 'loaded_at'])
+
+def storePath(config):
+    return config.get('MAPPED_STORE') or config.get('EMBEDDED_STORE')
+
+def loadModels(config, engine, version):
+    '''
+    Open the store and load the dedupe settings into a matcher that
+    reads from it
+    '''
+
+    # dedupe, numpy and the Address variable are only imported here, so
+    # processes that never match don't pay for them
+    from geocoder.deduper import GeocodingGazetteer
+    from geocoder.mapped_store import MappedStore
+    from geocoder.bloom import BloomFilter
+    from geocoder.parsed_addresses import ParsedAddresses
+
+    columns = config.get('RECORD_COLUMNS') or RECORD_COLUMNS
+    hashed_keys = config.get('HASHED_BLOCK_KEYS', False)
+
+    if config.get('MAPPED_STORE'):
+        store = MappedStore(config['MAPPED_STORE'], columns=columns)
+    elif config.get('EMBEDDED_STORE'):
+        store = SQLiteStore(config['EMBEDDED_STORE'], 
+                            columns=columns, 
+                            hashed_keys=hashed_keys)
+    else:
+        packed_blocks_table = None
+        if config.get('PACKED_BLOCKS', False):
+            # The packed table only holds ids and addresses, so it would
+            # never be read
+            if config.get('FETCH_RECORDS_WITH_CANDIDATES', False):
+                raise ValueError('PACKED_BLOCKS needs FETCH_RECORDS_WITH_CANDIDATES '
+                                 'turned off')
+            packed_blocks_table = 'match_blocks_packed'
+
+        store = PostgresStore(engine, 
+                              columns=columns, 
+                              packed_blocks_table=packed_blocks_table,
+                              hashed_keys=hashed_keys,
+                              similarity_timeout=config.get('FALLBACK_TIMEOUT_MS'))
+
+    partitions = None
+    if config.get('PARTITIONED_BLOCKS', False):
+        if not isinstance(store, PostgresStore):
+            raise ValueError('PARTITIONED_BLOCKS needs the Postgres store')
+        partitions = store.partitions()
+
+    fallback_candidates = config.get('FALLBACK_CANDIDATES')
+    if fallback_candidates and not hasattr(store, 'similarRecords'):
+        logger.warning('FALLBACK_CANDIDATES needs the Postgres store, ignoring it')
+        fallback_candidates = None
+
+    bloom_filter = None
+    if config.get('BLOOM_FILTER'):
+        bloom_filter = BloomFilter.load(config['BLOOM_FILTER'])
+
+    parsed_addresses = None
+    if config.get('PARSED_ADDRESSES'):
+        parsed_addresses = ParsedAddresses(config['PARSED_ADDRESSES'])
+
+    record_columns = None
+    if config.get('FETCH_RECORDS_WITH_CANDIDATES', False):
+        record_columns = store.columns
+
+    with open(config.get('SETTINGS_FILE', SETTINGS_FILE), 'rb') as sf:
+        matcher = GeocodingGazetteer(sf,
+                                     engine=engine,
+                                     store=store,
+                                     max_block_size=config.get('GEOCODE_MAX_BLOCK_SIZE'),
+                                     max_candidates=config.get('GEOCODE_MAX_CANDIDATES'),
+                                     record_columns=record_columns,
+                                     bloom_filter=bloom_filter,
+                                     parsed_addresses=parsed_addresses,
+                                     partitions=partitions,
+                                     fallback_candidates=fallback_candidates)
+
+    return Models(matcher, store, version, time.time())
+
+
+class ModelRegistry(object):
+    '''
+    Holds the matcher and store currently used for geocoding.
+
+    `reload` builds a complete new set in the background and swaps it
+    in with a single assignment. Requests should call `get` once and
+    use what it returns throughout, so a request that started before
+    a swap finishes on the old version.
+    '''
+
+    def __init__(self):
+        self.models = None
+        self.load_lock = threading.Lock()
+        self.watcher = None
+
+        self.status = {
+            'ready': False,
+            'version': 0,
+            'loaded_at': None,
+            'load_seconds': None,
+            'reloading': False,
+            'error': None,
+        }
+
+    def get(self, config, engine):
+        models = self.models
+
+        if models is None:
+            with self.load_lock:
+                if self.models is None:
+                    self._load(config, engine)
+            models = self.models
+
+        return models
+
+    def _load(self, config, engine):
+        start = time.time()
+        version = self.status['version'] + 1
+
+        models = loadModels(config, engine, version)
+
+        self.models = models
+
+        # Not ready until warmUp has run a request through them
+        self.status.update({'version': version,
+                            'loaded_at': models.loaded_at,
+                            'load_seconds': time.time() - start,
+                            'error': None})
+
+        logger.info('Loaded geocoder models version %s in %f seconds',
+                    version, self.status['load_seconds'])
+
+        metrics.stage_seconds.observe(self.status['load_seconds'], 'load_models')
+
+        coldstart.mark('load_models')
+
+    def warmUp(self, config, engine, address='1 n ogden ave chicago il'):
+        '''
+        Load the models and run one address through them so that 
+        everything a request touches is loaded before the first request
+        '''
+
+        models = self.get(config, engine)
+        models.matcher.matchBatch([address])
+
+        self.status['ready'] = True
+
+        coldstart.mark('warm_up')
+        coldstart.logReport()
+
+        return models
+
+    def afterFork(self):
+        '''
+        Called in each worker process after it is forked from a master 
+        that already loaded the models
+        '''
+
+        models = self.models
+
+        if models is not None and hasattr(models.store, 'afterFork'):
+            models.store.afterFork()
+
+        self.watcher = None
+
+    def reload(self, config, engine, background=True):
+        '''
+        Load new models and swap them in. Returns False without doing
+        anything if a reload is already running.
+        '''
+
+        if not self.load_lock.acquire(False):
+            return False
+
+        self.status['reloading'] = True
+
+        def run():
+            try:
+                self._load(config, engine)
+            except Exception as e:
+                logger.exception('Reloading geocoder models failed')
+                self.status['error'] = str(e)
+            finally:
+                self.status['reloading'] = False
+                self.load_lock.release()
+
+        if background:
+            threading.Thread(target=run, name='geocoder-reload').start()
+        else:
+            run()
+
+        return True
+
+    def watch(self, config, engine, interval):
+        '''
+        Start a daemon thread that reloads whenever the settings file,
+        the embedded store or the Bloom filter changes on disk
+        '''
+
+        if self.watcher is not None:
+            return
+
+        paths = [config.get('SETTINGS_FILE', SETTINGS_FILE)]
+        if storePath(config):
+            paths.append(storePath(config))
+        if config.get('BLOOM_FILTER'):
+            paths.append(config['BLOOM_FILTER'])
+        if config.get('PARSED_ADDRESSES'):
+            paths.append(config['PARSED_ADDRESSES'])
+
+        def mtimes():
+            return [os.path.getmtime(p) if os.path.exists(p) else None \
+                        for p in paths]
+
+        def run():
+            last_seen = mtimes()
+            while True:
+                time.sleep(interval)
+                current = mtimes()
+                if current != last_seen:
+                    logger.info('Geocoder models changed on disk, reloading')
+                    # Try again next time if another reload was running
+                    # or this one failed, e.g. on a half written file
+                    reloaded = self.reload(config, engine, background=False)
+                    if reloaded and not self.status['error']:
+                        last_seen = current
+
+        self.watcher = threading.Thread(target=run, name='geocoder-watcher')
+        self.watcher.daemon = True
+        self.watcher.start()
+
+registry = ModelRegistry()
@@ -0,0 +1,143 @@
+import re
+
+# Common long forms mapped to the USPS abbreviations used in the
+# Cook County address data
+ABBREVIATIONS = {
+    'north': 'n',
+    'south': 's',
+    'east': 'e',
+    'west': 'w',
+    'avenue': 'ave',
+    'av': 'ave',
+    'street': 'st',
+    'road': 'rd',
+    'boulevard': 'blvd',
+    'drive': 'dr',
+    'place': 'pl',
+    'court': 'ct',
+    'lane': 'ln',
+    'parkway': 'pkwy',
+    'terrace': 'ter',
+    'highway': 'hwy',
+    'square': 'sq',
+    'circle': 'cir',
+    'expressway': 'expy',
+    'plaza': 'plz',
+    'apartment': 'apt',
+    'suite': 'ste',
+    'illinois': 'il',
+}
+
+def preProcess(column):
+    if column :
+        column = str(column)
+        column = re.sub('  +', ' ', column)
+        column = re.sub('\n', ' ', column)
+        column = column.strip().strip('"').strip("'").lower().strip()
+        if not column :
+            column = ''
+    else :
+        column = ''
+
+    return column
+
+def normalizeAddress(address):
+    '''
+    Reduce an address to the form used as a key in the exact match
+    index: preProcess, drop punctuation and abbreviate long forms
+    '''
+
+    address = preProcess(address)
+    address = re.sub(r'[.,#]', ' ', address)
+
+    tokens = [ABBREVIATIONS.get(token, token) for token in address.split()]
+
+    return ' '.join(tokens)
+
+ZIPCODE = re.compile(r'^(\d{5})(-\d{4})?$')
+
+def placePrefixes(partitions):
+    '''
+    For each trailing part of a place name in `partitions`, the words
+    that come before it in longer place names: {'chicago heights':
+    {'south'}} if there is a 'place:south chicago heights'
+    '''
+
+    prefixes = {}
+
+    for partition in partitions:
+        if not partition.startswith('place:'):
+            continue
+
+        tokens = partition[len('place:'):].split()
+        for n in range(1, len(tokens)):
+            prefixes.setdefault(' '.join(tokens[n:]), set()).add(tokens[n - 1])
+
+    return prefixes
+
+def partitionKey(address, partitions, prefixes=None):
+    '''
+    The partition of the block index to search for an address: 
+    'zip:<zip>' if it ends in a zip code, otherwise 'place:<place>' for 
+    the place name in front of the state. None if neither is one of 
+    `partitions`.
+
+    The partition keys are the place names as they are in 
+    cook_county_addresses, lower cased, so the address is only lower 
+    cased and stripped of punctuation here, not abbreviated. A place 
+    is only returned if the address names all of it, and not if the 
+    word in front of it could be the start of a longer place name, 
+    like the 's' of 's chicago heights'. `prefixes` is 
+    placePrefixes(partitions), worth passing in when calling this for 
+    many addresses.
+    '''
+
+    tokens = re.sub(r'[.,#]', ' ', preProcess(address)).split()
+
+    if tokens:
+        zipcode = ZIPCODE.match(tokens[-1])
+        if zipcode:
+            key = 'zip:%s' % zipcode.group(1)
+            if key in partitions:
+                return key
+            tokens = tokens[:-1]
+
+    if tokens and tokens[-1] in ('il', 'illinois'):
+        tokens = tokens[:-1]
+
+    if prefixes is None:
+        prefixes = placePrefixes(partitions)
+
+    # Longest place name first, leaving at least one token of street
+    for n in range(min(4, len(tokens) - 1), 0, -1):
+        name = ' '.join(tokens[-n:])
+        key = 'place:%s' % name
+        if key in partitions:
+            before = tokens[-n - 1]
+            if any(prefix.startswith(before) for prefix in prefixes.get(name, ())):
+                return None
+            return key
+
+    return None
+
+def addressVariants(row):
+    '''
+    All of the keys a canonical address row should be found under:
+    the complete address, the street address alone and the street
+    address with the city and state but no zip code.
+    '''
+
+    variants = {normalizeAddress(row['complete_address'])}
+
+    street = row['complete_street_address']
+
+    if street:
+        place = ' '.join(str(f) for f in (row['usps_place_name'],
+                                          row['usps_state']) if f)
+
+        variants.add(normalizeAddress(street))
+        variants.add(normalizeAddress('%s %s' % (street, place)))
+
+    variants.discard('')
+
+    return variants
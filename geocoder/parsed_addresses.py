@@ -0,0 +1,212 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import usaddress
+
+class ParsedAddresses(object):
+    '''
+    The usaddress tags of every canonical address, read from a SQLite
+    file built by `buildParsedAddresses`. `install` makes the Address
+    fields of a dedupe data model look addresses up here before parsing
+    them, so canonical addresses are only ever parsed once.
+
+    `prefetch` loads the tags of a batch of addresses with a few
+    queries; addresses that weren't prefetched are looked up one at a
+    time. Addresses that aren't in the file, which is most messy
+    addresses, are parsed and the results of the last `miss_cache_size`
+    of them kept, so an address that comes back isn't looked up and
+    parsed again.
+    '''
+
+    chunk_size = 500
+
+    miss_cache_size = 10000
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise IOError('No parsed addresses found at %s' % path)
+
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.missed = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def __getstate__(self):
+        # Connections can't be pickled; each process opens its own
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    @property
+    def connection(self):
+        conn = getattr(self.local, 'connection', None)
+
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect('file:%s?mode=ro' % self.path, uri=True)
+            self.local.connection = conn
+            self.local.pid = os.getpid()
+            self.local.prefetched = {}
+
+        return conn
+
+    def prefetch(self, addresses):
+        addresses = list({address for address in addresses if address})
+
+        prefetched = {}
+
+        for i in range(0, len(addresses), self.chunk_size):
+            chunk = addresses[i:i + self.chunk_size]
+            sel = '''
+                SELECT address, address_type, tags
+                FROM parsed_addresses
+                WHERE address IN ({0})
+            '''.format(','.join('?' * len(chunk)))
+
+            for address, address_type, tags in self.connection.execute(sel, chunk):
+                prefetched[address] = (address_type, tags)
+
+        self.local.prefetched = prefetched
+
+    def lookup(self, address, parse):
+        '''
+        The tags of `address` from the file, or else from `parse`
+        '''
+
+        conn = self.connection
+
+        row = self.local.prefetched.get(address)
+
+        if row is None:
+            with self.lock:
+                parsed = self.missed.get(address)
+                if parsed is not None:
+                    self.missed.move_to_end(address)
+                    self.stats['misses'] += 1
+                    return parsed
+
+            row = conn.execute('''
+                SELECT address_type, tags
+                FROM parsed_addresses
+                WHERE address = ?
+            ''', (address,)).fetchone()
+
+        if row is None:
+            parsed = parse(address)
+
+            with self.lock:
+                self.stats['misses'] += 1
+                self.missed[address] = parsed
+                if len(self.missed) > self.miss_cache_size:
+                    self.missed.popitem(last=False)
+
+            return parsed
+
+        with self.lock:
+            self.stats['hits'] += 1
+
+        address_type, tags = row
+
+        return OrderedDict(json.loads(tags)), address_type
+
+    def tagger(self, parse):
+        return CachedTagger(self, parse)
+
+    def install(self, data_model):
+        '''
+        Wrap the tagger of every Address field of `data_model`
+        '''
+
+        for field in data_model.primary_fields:
+            if getattr(field, 'type', None) == 'Address':
+                field.tagger = self.tagger(field.tagger)
+
+
+class CachedTagger(object):
+    '''
+    Stands in for an Address field's tagger, falling back to `parse` for
+    addresses that aren't in `parsed_addresses`.
+
+    Address fields don't pickle their tagger, so a data model sent to
+    another process comes back parsing every address itself. Each
+    process has to `install` the cache on its own data model, as
+    `bulk.initWorker` and `async_app.initScorer` do by loading the
+    matcher there.
+    '''
+
+    def __init__(self, parsed_addresses, parse):
+        self.parsed_addresses = parsed_addresses
+        self.parse = parse
+
+    def __call__(self, address):
+        return self.parsed_addresses.lookup(address, self.parse)
+
+
+def buildParsedAddresses(engine,
+                         path,
+                         table='cook_county_addresses',
+                         address_field='complete_address',
+                         batch_size=10000):
+    '''
+    Parse every distinct address in `table` with usaddress and save the
+    tags to a SQLite file at `path`. Addresses usaddress can't parse are
+    left out and get parsed, and fail, at match time as before.
+    '''
+
+    tmp_path = '%s.tmp' % path
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+
+    try:
+        conn.execute('''
+            CREATE TABLE parsed_addresses (
+                address TEXT PRIMARY KEY,
+                address_type TEXT,
+                tags TEXT
+            ) WITHOUT ROWID
+        ''')
+
+        sel = '''
+            SELECT DISTINCT {0} AS address
+            FROM {1}
+            WHERE {0} IS NOT NULL
+        '''.format(address_field, table)
+
+        ins = 'INSERT INTO parsed_addresses VALUES (?, ?, ?)'
+
+        parsed = failed = 0
+
+        with engine.connect() as read_conn:
+            rows = read_conn.execution_options(stream_results=True).execute(sel)
+            while True:
+                batch = rows.fetchmany(batch_size)
+                if not batch:
+                    break
+
+                values = []
+                for address, in batch:
+                    try:
+                        tags, address_type = usaddress.tag(address)
+                    except usaddress.RepeatedLabelError:
+                        failed += 1
+                        continue
+                    values.append((address,
+                                   address_type,
+                                   json.dumps(list(tags.items()))))
+
+                conn.executemany(ins, values)
+                parsed += len(values)
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.rename(tmp_path, path)
+
+    return parsed, failed
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+class SingleFlight(object):
+    '''
+    Makes concurrent calls with the same key share one computation: the
+    first caller runs `func` and the ones that arrive while it is
+    running wait for it and get the same result (or exception).
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.stats = {'calls': 0, 'computations': 0, 'saved': 0}
+
+    def do(self, key, func, *args, **kwargs):
+        with self.lock:
+            self.stats['calls'] += 1
+            call = self.calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self.calls[key] = call
+                self.stats['computations'] += 1
+            else:
+                self.stats['saved'] += 1
+
+        if leader:
+            try:
+                call['result'] = func(*args, **kwargs)
+            except BaseException as e:
+                # Anything the leader raises, followers raise too, rather
+                # than returning a result that was never computed
+                call['error'] = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call['event'].set()
+        else:
+            call['event'].wait()
+
+        if call['error'] is not None:
+            raise call['error']
+
+        return call['result']
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+class AsyncSingleFlight(object):
+    '''
+    SingleFlight for coroutines running on one event loop
+    '''
+
+    def __init__(self):
+        self.calls = {}
+        self.stats = {'calls': 0, 'computations': 0, 'saved': 0}
+
+    async def do(self, key, func, *args, **kwargs):
+        self.stats['calls'] += 1
+
+        future = self.calls.get(key)
+
+        if future is not None:
+            self.stats['saved'] += 1
+            return await asyncio.shield(future)
+
+        self.stats['computations'] += 1
+        future = asyncio.ensure_future(func(*args, **kwargs))
+        self.calls[key] = future
+
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self.calls.get(key) is future:
+                del self.calls[key]
+
+    def snapshot(self):
+        return dict(self.stats)
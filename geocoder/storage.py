@@ -0,0 +1,556 @@
+import os
+import time
+import logging
+import struct
+import hashlib
+import sqlite3
+import threading
+from datetime import date
+from collections import OrderedDict
+
+import sqlalchemy as sa
+
+logger = logging.getLogger(__name__)
+
+# Columns of cook_county_addresses returned for each match. Override
+# with RECORD_COLUMNS in app_config.py.
+RECORD_COLUMNS = ('id',
+                  'address_id',
+                  'pin',
+                  'complete_address',
+                  'complete_street_address',
+                  'city_state_zipcode',
+                  'usps_place_name',
+                  'usps_state',
+                  'zipcode',
+                  'latitude',
+                  'longitude')
+
+def projection(columns=None):
+    '''
+    id and complete_address, which the matcher always needs, followed
+    by the rest of `columns`
+    '''
+
+    required = ('id', 'complete_address')
+
+    return required + tuple(c for c in columns or () if c not in required)
+
+def blockKeyHash(key):
+    '''
+    Stable unsigned 64 bit hash of a block key (or any string key)
+    '''
+
+    digest = hashlib.md5(key.encode('utf-8')).digest()
+    return struct.unpack('<Q', digest[:8])[0]
+
+def hashedBlockKey(key):
+    '''
+    blockKeyHash as a signed 64 bit integer, which is how block keys
+    are stored in a match_blocks table built with `hashed=True`
+    '''
+
+    key_hash = blockKeyHash(key)
+
+    return key_hash - (1 << 64) if key_hash >= (1 << 63) else key_hash
+
+
+class HashedKeys(object):
+    '''
+    Read only mapping from string keys to values stored under the
+    keys' hashes, so the map never has to hold the key strings
+    '''
+
+    def __init__(self, values, key_hash=blockKeyHash):
+        self.values = values
+        self.key_hash = key_hash
+
+    def __contains__(self, key):
+        return self.key_hash(key) in self.values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __bool__(self):
+        return bool(self.values)
+
+    def get(self, key, default=None):
+        return self.values.get(self.key_hash(key), default)
+
+
+def queryKeys(block_keys, hashed_keys):
+    '''
+    Dict from the values to look up in the block_key column to the 
+    block keys they stand for
+    '''
+
+    if hashed_keys:
+        return {hashedBlockKey(key): key for key in block_keys}
+
+    return {key: key for key in block_keys}
+
+
+class PostgresStore(object):
+    '''
+    Candidate lookup and canonical record fetches against the
+    cook_county_addresses and match_blocks tables in Postgres.
+
+    With `packed_blocks_table` (made by `createPackedBlocksTable`), 
+    candidates that only need their complete_address are read from it 
+    instead of joining match_blocks to the addresses. Set `hashed_keys` 
+    when the block tables were built with `hashed=True`.
+    '''
+
+    def __init__(self,
+                 engine,
+                 addresses_table='cook_county_addresses',
+                 match_blocks_table='match_blocks',
+                 exact_match_table='exact_match_addresses',
+                 columns=RECORD_COLUMNS,
+                 packed_blocks_table=None,
+                 hashed_keys=False,
+                 similarity_timeout=None):
+
+        self.engine = engine
+        self.addresses_table = addresses_table
+        self.match_blocks_table = match_blocks_table
+        self.exact_match_table = exact_match_table
+        self.columns = projection(columns)
+        self.packed_blocks_table = packed_blocks_table
+        self.hashed_keys = hashed_keys
+        self.similarity_timeout = similarity_timeout
+
+    def blockedRecords(self, block_keys, columns=None, partition=None):
+        '''
+        Yields a (block_key, id, record) row for every canonical address
+        covered by one of `block_keys`. The record holds complete_address
+        and any other `columns`. With a `partition`, only addresses in 
+        that partition of the partitioned block table are returned.
+        '''
+
+        columns = projection(columns)
+
+        if self.packed_blocks_table and columns == projection() and not partition:
+            for row in self.packedRecords(block_keys):
+                yield row
+            return
+
+        blocks_table = self.match_blocks_table
+        partition_filter = ''
+        if partition:
+            blocks_table = '%s_partitioned' % self.match_blocks_table
+            partition_filter = 'AND blocks.partition_key = :partition'
+
+        sel = '''
+            SELECT
+              blocks.block_key,
+              {2}
+            FROM {0} AS addresses
+            JOIN {1} AS blocks
+              USING(id)
+            WHERE blocks.block_key IN :block_keys
+              {3}
+        '''.format(self.addresses_table, 
+                   blocks_table,
+                   ', '.join('addresses.%s' % c for c in columns),
+                   partition_filter)
+
+        keys = queryKeys(block_keys, self.hashed_keys)
+
+        rows = self.engine.execute(sa.text(sel), 
+                                   block_keys=tuple(keys), 
+                                   partition=partition)
+
+        for row in rows:
+            yield (keys[row.block_key], 
+                   row.id, 
+                   OrderedDict((c, row[c]) for c in columns))
+
+    def packedRecords(self, block_keys):
+        sel = '''
+            SELECT block_key, ids, addresses
+            FROM {0}
+            WHERE block_key IN :block_keys
+        '''.format(self.packed_blocks_table)
+
+        keys = queryKeys(block_keys, self.hashed_keys)
+
+        rows = self.engine.execute(sa.text(sel), block_keys=tuple(keys))
+
+        for row in rows:
+            for canon_id, complete_address in zip(row.ids, row.addresses):
+                yield (keys[row.block_key],
+                       canon_id,
+                       OrderedDict([('id', canon_id), 
+                                    ('complete_address', complete_address)]))
+
+    def similarRecords(self, addresses, limit=50, columns=None):
+        '''
+        For a list of (address, address_number) pairs, lists of up to 
+        `limit` (id, record) pairs for the canonical addresses most 
+        similar to each address by pg_trgm trigram similarity, only 
+        those starting with its address_number if it has one. All of 
+        the addresses are looked up in one query, which gives up and 
+        returns nothing after `similarity_timeout` milliseconds.
+        '''
+
+        columns = projection(columns)
+
+        similar = [[] for _ in addresses]
+
+        if not addresses:
+            return similar
+
+        sel = '''
+            SELECT queries.query_number, nearest.*
+            FROM unnest(CAST(:addresses AS VARCHAR[]), 
+                        CAST(:address_numbers AS VARCHAR[])) 
+              WITH ORDINALITY AS queries(address, address_number, query_number)
+            CROSS JOIN LATERAL (
+              SELECT {1}
+              FROM {0}
+              WHERE complete_address % queries.address
+                AND (queries.address_number IS NULL 
+                     OR complete_address LIKE queries.address_number || ' %')
+              ORDER BY similarity(complete_address, queries.address) DESC, id
+              LIMIT :limit
+            ) AS nearest
+        '''.format(self.addresses_table, ', '.join(columns))
+
+        try:
+            with self.engine.begin() as conn:
+                if self.similarity_timeout:
+                    conn.execute('SET LOCAL statement_timeout = %d' % self.similarity_timeout)
+
+                rows = conn.execute(sa.text(sel), 
+                                    addresses=[a for a, _ in addresses],
+                                    address_numbers=[n for _, n in addresses],
+                                    limit=limit).fetchall()
+        except sa.exc.DBAPIError:
+            logger.warning('Similar address lookup for %s addresses failed or timed out', 
+                           len(addresses))
+            return similar
+
+        for row in rows:
+            similar[row.query_number - 1].append(
+                (row.id, OrderedDict((c, row[c]) for c in columns)))
+
+        return similar
+
+    def partitions(self):
+        '''
+        The partition keys of the partitioned block table
+        '''
+
+        sel = 'SELECT partition_key FROM {0}_partitions'.format(self.match_blocks_table)
+
+        return {row.partition_key for row in self.engine.execute(sel)}
+
+    def oversizedBlocks(self, max_block_size):
+        sel = '''
+            SELECT block_key, block_size
+            FROM {0}_stats
+            WHERE block_size > :max_block_size
+        '''.format(self.match_blocks_table)
+
+        rows = self.engine.execute(sa.text(sel), max_block_size=max_block_size)
+
+        sizes = {row.block_key: row.block_size for row in rows}
+
+        if self.hashed_keys:
+            return HashedKeys(sizes, hashedBlockKey)
+
+        return sizes
+
+    def records(self, ids):
+        '''
+        Returns a dict of canonical address rows by id, with the 
+        store's columns
+        '''
+
+        if not ids:
+            return {}
+
+        sel = '''
+            SELECT {1} FROM {0}
+            WHERE id IN :ids
+        '''.format(self.addresses_table, ', '.join(self.columns))
+
+        curs = self.engine.execute(sa.text(sel), ids=tuple(ids))
+
+        return {row.id: OrderedDict(zip(row.keys(), row.values())) \
+                    for row in curs}
+
+    def exactMatchIds(self, address_keys):
+        '''
+        Returns a dict from each of `address_keys` found in the exact
+        match table to the set of canonical ids stored under it
+        '''
+
+        if not address_keys:
+            return {}
+
+        sel = '''
+            SELECT DISTINCT address_key, id
+            FROM {0}
+            WHERE address_key IN :address_keys
+        '''.format(self.exact_match_table)
+
+        rows = self.engine.execute(sa.text(sel), address_keys=tuple(address_keys))
+
+        ids = {}
+        for row in rows:
+            ids.setdefault(row.address_key, set()).add(row.id)
+
+        return ids
+
+
+class SQLiteStore(object):
+    '''
+    The same lookups as PostgresStore, read from a SQLite file built by
+    `exportSQLite` so the geocoder can run without a database server.
+    Each thread gets its own read only connection.
+    '''
+
+    # Stay well under SQLite's limit on the number of bound parameters
+    chunk_size = 500
+
+    def __init__(self, path, columns=RECORD_COLUMNS, hashed_keys=False):
+        if not os.path.exists(path):
+            raise IOError('No embedded store found at %s' % path)
+
+        self.path = path
+        self.local = threading.local()
+        self.columns = projection(columns)
+        self.hashed_keys = hashed_keys
+
+    @property
+    def connection(self):
+        conn = getattr(self.local, 'connection', None)
+
+        if conn is None:
+            conn = sqlite3.connect('file:%s?mode=ro' % self.path, uri=True)
+            conn.row_factory = sqlite3.Row
+            self.local.connection = conn
+
+        return conn
+
+    def afterFork(self):
+        '''
+        SQLite connections can't be shared with a forked child, so
+        forget any opened before the fork
+        '''
+
+        self.local = threading.local()
+
+    def _select(self, sel, values):
+        values = list(values)
+
+        for i in range(0, len(values), self.chunk_size):
+            chunk = values[i:i + self.chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            for row in self.connection.execute(sel.format(placeholders), chunk):
+                yield row
+
+    def blockedRecords(self, block_keys, columns=None):
+        columns = projection(columns)
+
+        sel = '''
+            SELECT
+              blocks.block_key,
+              %s
+            FROM match_blocks AS blocks
+            JOIN cook_county_addresses AS addresses
+              ON addresses.id = blocks.id
+            WHERE blocks.block_key IN ({0})
+        ''' % ', '.join('addresses.%s' % c for c in columns)
+
+        keys = queryKeys(block_keys, self.hashed_keys)
+
+        for row in self._select(sel, keys):
+            yield (keys[row['block_key']], 
+                   row['id'], 
+                   OrderedDict((c, row[c]) for c in columns))
+
+    def oversizedBlocks(self, max_block_size):
+        sel = '''
+            SELECT block_key, block_size
+            FROM match_blocks_stats
+            WHERE block_size > ?
+        '''
+
+        rows = self.connection.execute(sel, (max_block_size,))
+
+        sizes = {row['block_key']: row['block_size'] for row in rows}
+
+        if self.hashed_keys:
+            return HashedKeys(sizes, hashedBlockKey)
+
+        return sizes
+
+    def records(self, ids):
+        sel = '''
+            SELECT %s FROM cook_county_addresses
+            WHERE id IN ({0})
+        ''' % ', '.join(self.columns)
+
+        return {row['id']: OrderedDict(zip(row.keys(), row)) \
+                    for row in self._select(sel, ids)}
+
+    def exactMatchIds(self, address_keys):
+        sel = '''
+            SELECT DISTINCT address_key, id
+            FROM exact_match_addresses
+            WHERE address_key IN ({0})
+        '''
+
+        ids = {}
+        for row in self._select(sel, address_keys):
+            ids.setdefault(row['address_key'], set()).add(row['id'])
+
+        return ids
+
+
+def compareBlockLayouts(engine,
+                        match_blocks_table='match_blocks',
+                        n_queries=200,
+                        keys_per_query=10):
+    '''
+    Report the size on disk of the match_blocks table and its index 
+    against the packed table, and the latency of the same random 
+    candidate lookups against each
+    '''
+
+    packed_table = '%s_packed' % match_blocks_table
+
+    size = '''
+        SELECT pg_total_relation_size(CAST(:table AS regclass))
+    '''
+
+    sizes = {name: engine.execute(sa.text(size), table=table).scalar() \
+                 for name, table in (('join', match_blocks_table),
+                                     ('packed', packed_table))}
+
+    sel = '''
+        SELECT block_key
+        FROM {0}_stats
+        ORDER BY random()
+        LIMIT :limit
+    '''.format(match_blocks_table)
+
+    # Sampled straight from the table, so for hashed tables these are
+    # already hashes and the stores look them up as they are
+    keys = [row.block_key for row in \
+                engine.execute(sa.text(sel), limit=n_queries * keys_per_query)]
+
+    queries = [keys[i:i + keys_per_query] \
+                   for i in range(0, len(keys), keys_per_query)]
+
+    stores = (('join', PostgresStore(engine, 
+                                     match_blocks_table=match_blocks_table)),
+              ('packed', PostgresStore(engine, 
+                                       match_blocks_table=match_blocks_table,
+                                       packed_blocks_table=packed_table)))
+
+    report = OrderedDict()
+    for name, store in stores:
+        timings = []
+        n_rows = 0
+        for query in queries:
+            start = time.time()
+            n_rows += sum(1 for _ in store.blockedRecords(query))
+            timings.append(time.time() - start)
+
+        timings.sort()
+        n = len(timings)
+
+        report[name] = OrderedDict([
+            ('bytes', sizes[name]),
+            ('queries', n),
+            ('rows', n_rows),
+            ('mean_ms', 1000 * sum(timings) / n if n else 0.0),
+            ('p50_ms', 1000 * timings[n // 2] if n else 0.0),
+            ('p95_ms', 1000 * timings[int(n * 0.95)] if n else 0.0),
+        ])
+
+    return report
+
+def sqliteType(column_type):
+    if isinstance(column_type, sa.Integer):
+        return 'INTEGER'
+    elif isinstance(column_type, (sa.Float, sa.Numeric)):
+        return 'REAL'
+    else:
+        return 'TEXT'
+
+def sqliteValue(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+def exportSQLite(engine,
+                 path,
+                 tables=('cook_county_addresses',
+                         'match_blocks',
+                         'match_blocks_stats',
+                         'exact_match_addresses'),
+                 batch_size=10000):
+    '''
+    Copy the tables the geocoder reads from Postgres into a SQLite file
+    at `path` and index them the way the Postgres tables are indexed.
+    Tables that don't exist yet are skipped.
+    '''
+
+    tmp_path = '%s.tmp' % path
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    meta = sa.MetaData()
+    meta.reflect(bind=engine, only=lambda name, _: name in tables)
+
+    conn = sqlite3.connect(tmp_path)
+
+    try:
+        for table_name in tables:
+            if table_name not in meta.tables:
+                logger.warning('Skipping %s, it does not exist', table_name)
+                continue
+
+            table = meta.tables[table_name]
+            columns = list(table.columns)
+
+            conn.execute('CREATE TABLE {0} ({1})'.format(
+                table_name,
+                ', '.join('%s %s' % (c.name, sqliteType(c.type)) for c in columns)))
+
+            ins = 'INSERT INTO {0} VALUES ({1})'.format(table_name,
+                                                         ','.join('?' * len(columns)))
+
+            with engine.connect() as read_conn:
+                rows = read_conn.execution_options(stream_results=True)\
+                                .execute(table.select())
+                while True:
+                    batch = rows.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    conn.executemany(ins, ([sqliteValue(v) for v in row] \
+                                               for row in batch))
+            conn.commit()
+
+        indexes = {
+            'cook_county_addresses': 'CREATE UNIQUE INDEX cook_county_addresses_id_idx ON cook_county_addresses (id)',
+            'match_blocks': 'CREATE INDEX match_blocks_key_idx ON match_blocks (block_key, id)',
+            'match_blocks_stats': 'CREATE UNIQUE INDEX match_blocks_stats_key_idx ON match_blocks_stats (block_key)',
+            'exact_match_addresses': 'CREATE INDEX exact_match_addresses_key_idx ON exact_match_addresses (address_key)',
+        }
+
+        for table_name, create_index in indexes.items():
+            if table_name in meta.tables:
+                conn.execute(create_index)
+
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.rename(tmp_path, path)
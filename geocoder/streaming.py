@@ -0,0 +1,140 @@
+'''
+Reading and writing the line oriented formats accepted by
+/geocode/stream. Everything works on iterators so that neither the
+upload nor the response is ever held in memory.
+'''
+import io
+import csv
+import json
+
+# Columns added to each CSV row, filled in from the best match. They
+# all start with match_ so they don't clash with the input's own
+# latitude, longitude and so on.
+CSV_MATCH_COLUMNS = ('match_id',
+                     'match_address',
+                     'match_latitude',
+                     'match_longitude',
+                     'match_confidence',
+                     'match_fast_path')
+
+def decodeLines(stream):
+    for line in stream:
+        yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+def readNDJSON(lines, column='address'):
+    '''
+    Yields (row, address, error) for each non blank line, where a line
+    is either a JSON object with the address under `column` or a JSON
+    string
+    '''
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield None, None, 'line is not valid JSON'
+            continue
+
+        if isinstance(row, dict):
+            address = row.get(column)
+        else:
+            address, row = row, {column: row}
+
+        if not isinstance(address, str) or not address.strip():
+            yield row, None, '%s is required' % column
+        else:
+            yield row, address, None
+
+def readCSV(lines, column='address'):
+    '''
+    Yields (row, address, error) for each row of a CSV with a header
+    that includes `column`. Yields a single error if it doesn't.
+    '''
+
+    reader = csv.DictReader(lines)
+
+    if reader.fieldnames is None or column not in reader.fieldnames:
+        yield None, None, 'the CSV header has no %s column' % column
+        return
+
+    for row in reader:
+        address = row.get(column)
+
+        if not address or not address.strip():
+            yield row, None, '%s is required' % column
+        else:
+            yield row, address, None
+
+def microBatches(rows, max_size, first_size=1):
+    '''
+    Group `rows` into lists that start at `first_size` and double up to
+    `max_size`, so the first results go out as soon as the first rows
+    are in
+    '''
+
+    batch = []
+    size = first_size
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+            size = min(size * 2, max_size)
+
+    if batch:
+        yield batch
+
+def ndjsonLine(row, matches, fast_path, error, dthandler=None):
+    result = {'input': row,
+              'matches': matches,
+              'fast_path': fast_path}
+
+    if error:
+        result = {'input': row, 'error': error}
+
+    return json.dumps(result, default=dthandler) + '\n'
+
+class CSVWriter(object):
+    '''
+    Formats rows one at a time: the input columns followed by
+    CSV_MATCH_COLUMNS for the best match and a match_error column
+    '''
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.fieldnames = None
+
+    def _flush(self):
+        value = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return value
+
+    def line(self, row, matches, fast_path, error):
+        output = ''
+
+        if self.fieldnames is None:
+            self.fieldnames = list(row or {})
+            self.writer.writerow(self.fieldnames + list(CSV_MATCH_COLUMNS) + ['match_error'])
+            output = self._flush()
+
+        best = matches[0] if matches else {}
+
+        values = [(row or {}).get(name, '') for name in self.fieldnames]
+        values += [best.get('id', ''),
+                   best.get('complete_address', ''),
+                   best.get('latitude', ''),
+                   best.get('longitude', ''),
+                   best.get('confidence', ''),
+                   fast_path if not error else '',
+                   error or '']
+
+        self.writer.writerow(values)
+
+        return output + self._flush()
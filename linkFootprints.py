@@ -0,0 +1,209 @@
+import time
+import multiprocessing
+import sqlalchemy as sa
+from sqlalchemy import create_engine
+
+DB_URL = 'postgresql://localhost:5432/geocoder'
+
+# Set up once per worker process by initWorker
+deduper = None
+
+def createPointIndex(engine):
+    '''
+    GIST index on the address points so the spatial join against
+    building_footprints.geom can use an index scan on both sides
+    '''
+
+    with engine.begin() as conn:
+        conn.execute('DROP INDEX IF EXISTS cook_county_addresses_point_idx')
+        conn.execute('''
+            CREATE INDEX cook_county_addresses_point_idx
+              ON cook_county_addresses
+              USING GIST (ST_SetSRID(ST_MakePoint(longitude, latitude), 4326))
+        ''')
+        conn.execute('ANALYZE cook_county_addresses')
+
+def footprintChunks(engine, chunk_size):
+    unlinked = '''
+        SELECT id
+        FROM building_footprints
+        WHERE address_id IS NULL
+          AND complete_address IS NOT NULL
+        ORDER BY id
+    '''
+
+    chunk = []
+    for row in engine.execute(unlinked):
+        chunk.append(row.id)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+def initWorker(settings_path):
+    global deduper
+    from geocoder.deduper import FootprintLinkGazetteer
+
+    engine = create_engine(DB_URL)
+
+    # Parallelism comes from the pool so each worker scores in-process
+    with open(settings_path, 'rb') as sf:
+        deduper = FootprintLinkGazetteer(sf, engine=engine, num_cores=1)
+
+def linkChunk(args):
+    footprint_ids, tolerance, threshold = args
+
+    messy_data = {
+        'footprint_ids': footprint_ids,
+        'tolerance': tolerance,
+    }
+
+    matches = deduper.match(messy_data, threshold=threshold, n_matches=1)
+
+    links = []
+    for match in matches:
+        for link in match:
+            (footprint_id, canonical_id), confidence = link
+            links.append((int(footprint_id),
+                          int(canonical_id),
+                          float(confidence)))
+
+    return len(footprint_ids), links
+
+def saveLinks(engine, links):
+    with engine.begin() as conn:
+        conn.execute('DROP TABLE IF EXISTS footprint_temp_matches')
+        conn.execute('''
+            CREATE TABLE footprint_temp_matches (
+                footprint_id INTEGER,
+                canonical_id INTEGER,
+                confidence DOUBLE PRECISION
+            )
+        ''')
+
+    ins = '''
+        INSERT INTO footprint_temp_matches
+          (footprint_id, canonical_id, confidence)
+          VALUES (%s, %s, %s)
+    '''
+
+    write_conn = engine.raw_connection()
+    curs = write_conn.cursor()
+
+    try:
+        curs.executemany(ins, links)
+        write_conn.commit()
+    except:
+        write_conn.rollback()
+        raise
+    finally:
+        curs.close()
+        write_conn.close()
+
+    update_footprints = '''
+        UPDATE building_footprints SET
+          address_id = subq.address_id
+        FROM (
+          SELECT
+            c.address_id,
+            t.footprint_id
+          FROM cook_county_addresses AS c
+          JOIN footprint_temp_matches AS t
+            ON c.id = t.canonical_id
+        ) AS subq
+        WHERE building_footprints.id = subq.footprint_id
+    '''
+
+    with engine.begin() as conn:
+        records = conn.execute(update_footprints)
+
+    return records.rowcount
+
+def linkFootprints(settings_path='geocoder/data/dedupe.settings',
+                   processes=None,
+                   chunk_size=500,
+                   tolerance=0.0002,
+                   threshold=0.5,
+                   create_index=True):
+
+    engine = create_engine(DB_URL)
+
+    if create_index:
+        createPointIndex(engine)
+
+    work = ((chunk, tolerance, threshold) \
+                for chunk in footprintChunks(engine, chunk_size))
+
+    links = []
+    n_footprints = 0
+    start = time.time()
+
+    pool = multiprocessing.Pool(processes,
+                                initializer=initWorker,
+                                initargs=(settings_path,))
+
+    try:
+        for chunk_count, chunk_links in pool.imap_unordered(linkChunk, work):
+            n_footprints += chunk_count
+            links.extend(chunk_links)
+            print('Linked %s of %s footprints (%.1f/sec)' \
+                    % (len(links), n_footprints,
+                       n_footprints / (time.time() - start)))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    saved = 0
+    if links:
+        saved = saveLinks(engine, links)
+
+    engine.dispose()
+
+    return saved
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Link building footprints to Cook County addresses.'
+    )
+
+    parser.add_argument('--processes',
+                        type=int,
+                        default=None,
+                        help='Number of worker processes (defaults to CPU count)')
+
+    parser.add_argument('--chunk_size',
+                        type=int,
+                        default=500,
+                        help='Number of footprints handed to a worker at a time')
+
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.0002,
+                        help='Distance in degrees around a footprint to look for addresses')
+
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=0.5,
+                        help='Minimum match confidence')
+
+    parser.add_argument('--skip_index',
+                        action='store_true',
+                        help="Don't (re)build the address point index first")
+
+    args = parser.parse_args()
+
+    saved = linkFootprints(processes=args.processes,
+                           chunk_size=args.chunk_size,
+                           tolerance=args.tolerance,
+                           threshold=args.threshold,
+                           create_index=not args.skip_index)
+
+    print('Saved: %s records' % saved)
@@ -68,7 +68,7 @@ def trainIncoming(name):
 
     deduper.cleanupTraining()
 
-def blockIncoming(name, train):
+def blockIncoming(name, train, hashed=False):
     from geocoder.deduper import StaticDatabaseGazetteer
 
     engine = create_engine('postgresql://localhost:5432/geocoder')
@@ -79,11 +79,12 @@ def blockIncoming(name, train):
     # If we trained, re-block the county addresses table 
     # in light of the newly trained settings file
     if train:
-        deduper.createMatchBlocksTable()
+        deduper.createMatchBlocksTable(hashed=hashed)
     
     # Block the new table, too
     deduper.createMatchBlocksTable(table_to_block=name,
-                                   match_blocks_table='%s_match_blocks' % name)
+                                   match_blocks_table='%s_match_blocks' % name,
+                                   hashed=hashed)
 
 
 if __name__ == "__main__":
@@ -121,6 +122,18 @@ if __name__ == "__main__":
     parser.add_argument('--link',
                         action='store_true',
                         help="Link messy data")
+    
+    parser.add_argument('--hashed',
+                        action='store_true',
+                        help="Block keys are stored as 64 bit hashes")
+    
+    parser.add_argument('--parsed_addresses',
+                        type=str,
+                        help="Parsed canonical addresses from loadAddresses.py --parse")
+    
+    parser.add_argument('--parquet',
+                        action='store_true',
+                        help="Also write the matches to geocoder/data/<name>_matches.parquet")
 
     args = parser.parse_args()
     
@@ -165,7 +178,7 @@ if __name__ == "__main__":
         trainIncoming(args.name)
 
     if args.block:
-        blockIncoming(args.name, args.train)
+        blockIncoming(args.name, args.train, hashed=args.hashed)
 
     if args.link:
         from geocoder.deduper import AddressLinkGazetteer
@@ -179,8 +192,16 @@ if __name__ == "__main__":
         
         primary_key = sql_table.primary_key.columns.keys()[0]
         
+        parsed_addresses = None
+        if args.parsed_addresses:
+            from geocoder.parsed_addresses import ParsedAddresses
+            parsed_addresses = ParsedAddresses(args.parsed_addresses)
+
         with open('geocoder/dedupe.settings', 'rb') as sf:
-            deduper = AddressLinkGazetteer(sf, engine=engine)
+            deduper = AddressLinkGazetteer(sf, 
+                                           engine=engine, 
+                                           hashed_keys=args.hashed,
+                                           parsed_addresses=parsed_addresses)
         
         messy_data_info = {
             'messy_data_table': args.name,
@@ -255,6 +276,13 @@ if __name__ == "__main__":
         
         print('Saved: %s records' % records.rowcount)
 
+        if args.parquet:
+            from geocoder.columnar import exportMatches
+
+            parquet_path = 'geocoder/data/%s_matches.parquet' % args.name
+            exported = exportMatches(engine, args.name, parquet_path)
+            print('Wrote %s matches to %s' % (exported, parquet_path))
+
         while True:
             unlinked_records = ''' 
                 SELECT COUNT(*) AS record_count
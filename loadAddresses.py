@@ -188,6 +188,43 @@ if __name__ == "__main__":
     parser.add_argument('--block',
                         action='store_true',
                         help="Pre-block addresses")
+    
+    parser.add_argument('--trigram',
+                        action='store_true',
+                        help="Build the pg_trgm index used to find candidates for addresses blocking misses")
+    
+    parser.add_argument('--parse',
+                        action='store_true',
+                        help="Parse every canonical address once and save the tags to geocoder/data/parsed_addresses.sqlite")
+    
+    parser.add_argument('--bloom_error_rate',
+                        type=float,
+                        default=0.01,
+                        help="False positive rate of the block key Bloom filter written by --block")
+    
+    parser.add_argument('--hashed',
+                        action='store_true',
+                        help="Store block keys as 64 bit hashes (see HASHED_BLOCK_KEYS in app_config.py)")
+    
+    parser.add_argument('--key_dictionary',
+                        action='store_true',
+                        help="With --hashed, also write the keys behind the hashes to match_blocks_keys")
+    
+    parser.add_argument('--partition',
+                        action='store_true',
+                        help="Also build the block table partitioned by zip code and place name")
+    
+    parser.add_argument('--packed',
+                        action='store_true',
+                        help="Also build the packed block table and compare its size and lookup latency to match_blocks")
+    
+    parser.add_argument('--report',
+                        action='store_true',
+                        help="Write blocking statistics for the block table to geocoder/data/block_report.json (with --hashed, the table needs --key_dictionary)")
+    
+    parser.add_argument('--exact',
+                        action='store_true',
+                        help="Build the exact match lookup used by the geocoder fast path")
 
     args = parser.parse_args()
     
@@ -260,4 +297,83 @@ if __name__ == "__main__":
         with open('geocoder/data/dedupe.settings', 'rb') as sf:
             deduper = StaticDatabaseGazetteer(sf, engine=engine)
         
-        deduper.createMatchBlocksTable()
+        deduper.createMatchBlocksTable(packed=args.packed,
+                                       hashed=args.hashed,
+                                       key_dictionary=args.key_dictionary,
+                                       bloom_filter='geocoder/data/block_keys.bloom',
+                                       bloom_error_rate=args.bloom_error_rate)
+
+        if args.partition:
+            deduper.createPartitionedBlocksTable()
+
+    if args.packed:
+        from geocoder.deduper import StaticDatabaseGazetteer
+        from geocoder.storage import compareBlockLayouts
+        import simplejson as json
+
+        engine = create_engine('postgresql://localhost:5432/geocoder')
+
+        if not args.block:
+            with open('geocoder/data/dedupe.settings', 'rb') as sf:
+                deduper = StaticDatabaseGazetteer(sf, engine=engine)
+            
+            deduper.createPackedBlocksTable()
+
+        print(json.dumps(compareBlockLayouts(engine), indent=2))
+
+        engine.dispose()
+
+    if args.trigram:
+        from geocoder.fallback import createTrigramIndex
+
+        engine = create_engine('postgresql://localhost:5432/geocoder')
+        
+        createTrigramIndex(engine)
+        
+        engine.dispose()
+
+    if args.parse:
+        from geocoder.parsed_addresses import buildParsedAddresses
+
+        engine = create_engine('postgresql://localhost:5432/geocoder')
+        
+        parsed, failed = buildParsedAddresses(engine, 
+                                              'geocoder/data/parsed_addresses.sqlite')
+
+        print('Parsed %s addresses, %s could not be parsed' % (parsed, failed))
+        
+        engine.dispose()
+
+    if args.exact:
+        from geocoder.exact_match import createExactMatchTable
+
+        engine = create_engine('postgresql://localhost:5432/geocoder')
+        
+        createExactMatchTable(engine)
+        
+        engine.dispose()
+
+    if args.report:
+        from geocoder.deduper import StaticDatabaseGazetteer
+        import simplejson as json
+
+        engine = create_engine('postgresql://localhost:5432/geocoder')
+        
+        with open('geocoder/data/dedupe.settings', 'rb') as sf:
+            deduper = StaticDatabaseGazetteer(sf, engine=engine)
+        
+        messy_data = json.load(open('geocoder/data/messy_addresses.json'))
+        messy_addresses = [row['complete_address'] for row in messy_data]
+
+        report = deduper.blockingReport(messy_addresses=messy_addresses,
+                                        hashed_keys=args.hashed)
+
+        with open('geocoder/data/block_report.json', 'w') as f:
+            json.dump(report, f, indent=2)
+
+        for predicate in report['predicates']:
+            print('{predicate}: {block_keys} keys, largest block {max_block_size}, '
+                  '~{estimated_candidates_per_query:.1f} candidates per query'\
+                  .format(**predicate))
+        
+        engine.dispose()
@@ -0,0 +1,54 @@
+from aiohttp import web
+from sqlalchemy import create_engine
+
+from geocoder.async_app import createAsyncApp
+import geocoder.app_config as app_config
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(
+        description='Run the geocoder on asyncio.'
+    )
+
+    parser.add_argument('--port',
+                        type=int,
+                        default=5000,
+                        help='Port to listen on')
+
+    parser.add_argument('--pool_size',
+                        type=int,
+                        default=20,
+                        help='Number of pooled database connections')
+
+    parser.add_argument('--scoring_processes',
+                        type=int,
+                        default=None,
+                        help='Number of processes blocking and scoring addresses (defaults to CPU count)')
+
+    parser.add_argument('--max_pending',
+                        type=int,
+                        default=None,
+                        help='Most batches waiting on the scoring processes at once (defaults to 4 per process)')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    config = {k: getattr(app_config, k) for k in dir(app_config) if k.isupper()}
+
+    dsn = 'postgresql://{0}:{1}@{2}:{3}/{4}'.format(app_config.DB_USER,
+                                                    app_config.DB_PW,
+                                                    app_config.DB_HOST,
+                                                    app_config.DB_PORT,
+                                                    app_config.DB_NAME)
+
+    app = createAsyncApp(config,
+                         create_engine(app_config.DB_CONN),
+                         dsn,
+                         pool_size=args.pool_size,
+                         scoring_processes=args.scoring_processes,
+                         max_pending=args.max_pending)
+
+    web.run_app(app, port=args.port)
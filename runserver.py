@@ -1,3 +1,5 @@
+import os
+
 from geocoder import create_app
 
 app = create_app()
@@ -8,4 +10,14 @@ if __name__ == "__main__":
         port = int(sys.argv[1])
     except (IndexError, ValueError):
         port = 5000
+
+    # The reloader runs this twice; only the child it starts serves
+    # requests, so only warm up there
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from geocoder.database import engine
+        from geocoder.models import registry
+
+        with app.app_context():
+            registry.warmUp(app.config, engine)
+
     app.run(debug=True, port=port)
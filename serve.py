@@ -0,0 +1,118 @@
+'''
+Production entry point. The master process loads and warms up the
+dedupe settings, store and caches before forking the workers, so the
+workers start ready and share those pages copy-on-write.
+
+    python serve.py --workers 4 --threads 2 --bind 0.0.0.0:5000
+'''
+import gc
+import time
+import logging
+
+from gunicorn.app.base import BaseApplication
+
+logger = logging.getLogger(__name__)
+
+def postFork(server, worker):
+    from geocoder.database import engine
+    from geocoder.models import registry
+
+    # Connections opened by the master during warm up can't be shared
+    engine.dispose()
+    registry.afterFork()
+
+class GeocoderApplication(BaseApplication):
+
+    def __init__(self, options):
+        self.options = options
+        super(GeocoderApplication, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from geocoder import create_app
+        from geocoder.database import engine
+        from geocoder.models import registry
+
+        start = time.time()
+
+        app = create_app()
+
+        with app.app_context():
+            registry.warmUp(app.config, engine)
+
+        engine.dispose()
+
+        # Keep the garbage collector from touching (and so copying) the
+        # pages of everything loaded so far in the workers
+        if hasattr(gc, 'freeze'):
+            gc.collect()
+            gc.freeze()
+
+        logger.info('Geocoder warmed up in %f seconds', time.time() - start)
+
+        return app
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Run the geocoder with pre-forked workers.'
+    )
+
+    parser.add_argument('--bind',
+                        type=str,
+                        default='127.0.0.1:5000',
+                        help='Address to listen on')
+
+    parser.add_argument('--workers',
+                        type=int,
+                        default=4,
+                        help='Number of worker processes')
+
+    parser.add_argument('--threads',
+                        type=int,
+                        default=1,
+                        help='Number of threads per worker')
+
+    parser.add_argument('--max_requests',
+                        type=int,
+                        default=10000,
+                        help='Recycle a worker after this many requests (0 never recycles)')
+
+    parser.add_argument('--max_requests_jitter',
+                        type=int,
+                        default=1000,
+                        help='Randomize max_requests by up to this much so workers are not all recycled at once')
+
+    parser.add_argument('--timeout',
+                        type=int,
+                        default=60,
+                        help='Restart a worker that is silent for this many seconds')
+
+    parser.add_argument('--graceful_timeout',
+                        type=int,
+                        default=30,
+                        help='Seconds a recycled worker gets to finish its requests')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'preload_app': True,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'post_fork': postFork,
+    }
+
+    GeocoderApplication(options).run()
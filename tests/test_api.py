@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+import time
+import importlib
+
+import pytest
+from flask import Flask, g
+
+from geocoder.models import Models
+
+# geocoder/__init__.py shadows the module with its blueprint
+api = importlib.import_module('geocoder.api')
+
+RECORDS = {1: {'id': 1,
+               'complete_address': '1 N OGDEN AVE',
+               'latitude': 41.88,
+               'longitude': -87.66}}
+
+class FakeMatcher(object):
+    bloom_filter = None
+
+    def matchBatch(self, addresses, n_matches=5, threshold=0.75, stats=None, records=None):
+        if stats is not None:
+            stats.update({'timings': {}, 'pairs': len(addresses)})
+        if records is not None:
+            records.update(RECORDS)
+        return [[(1, 0.9)] for _ in addresses]
+
+@pytest.fixture
+def client(monkeypatch):
+    models = Models(FakeMatcher(), None, 1, time.time())
+    monkeypatch.setattr(api, 'getModels', lambda: models)
+
+    app = Flask(__name__)
+    app.config['BATCH_MAX_SIZE'] = 2
+    app.register_blueprint(api.api)
+
+    @app.before_request
+    def before_request():
+        g.engine = None
+
+    return app.test_client()
+
+def testGeocode(client):
+    response = client.get('/geocode/?address=1+n+ogden+ave&debug=timings')
+    body = json.loads(response.get_data(as_text=True))
+
+    assert response.status_code == 200
+    assert body['matches'][0]['id'] == 1
+    assert body['candidates'] == 1
+
+def testGeocodeWithoutAddress(client):
+    response = client.get('/geocode/')
+
+    assert response.status_code == 400
+
+def testBatch(client):
+    response = client.post('/geocode/batch/',
+                           data=json.dumps({'addresses': ['1 n ogden ave']}))
+    body = json.loads(response.get_data(as_text=True))
+
+    assert response.status_code == 200
+    assert body['results'][0]['matches'][0]['confidence'] == 0.9
+
+@pytest.mark.parametrize('payload', [{}, {'addresses': 'x'}, {'addresses': ['a', 'b', 'c']}])
+def testBatchErrors(client, payload):
+    response = client.post('/geocode/batch/', data=json.dumps(payload))
+    body = json.loads(response.get_data(as_text=True))
+
+    assert response.status_code == 400
+    assert body['status'] == 'error'
+
+@pytest.mark.parametrize('path', ['/geocode/stream', '/geocode/stream/'])
+def testStreamNDJSON(client, path):
+    data = '{"address": "1 n ogden ave"}\n{"id": 2}\n'
+
+    response = client.post(path, data=data, content_type='application/x-ndjson')
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert response.status_code == 200
+    assert lines[0]['matches'][0]['id'] == 1
+    assert lines[1] == {'input': {'id': 2}, 'error': 'address is required'}
+
+def testStreamCSVKeepsInputColumns(client):
+    data = 'address,latitude\n1 n ogden ave,41.9\n'
+
+    response = client.post('/geocode/stream', data=data, content_type='text/csv')
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+
+    assert response.status_code == 200
+    assert rows[0]['latitude'] == '41.9'
+    assert rows[0]['match_latitude'] == '41.88'
@@ -0,0 +1,39 @@
+from geocoder.bloom import BloomFilter
+from geocoder.storage import blockKeyHash
+
+def testAddedKeysAreFound():
+    bloom = BloomFilter.forCapacity(1000, 0.01)
+    keys = ['key:%d' % i for i in range(1000)]
+    bloom.addHashes([blockKeyHash(key) for key in keys])
+
+    assert all(key in bloom for key in keys)
+    assert bloom.n_keys == 1000
+
+def testErrorRateIsNearTarget():
+    bloom = BloomFilter.forCapacity(1000, 0.01)
+    bloom.addHashes([blockKeyHash('key:%d' % i) for i in range(1000)])
+
+    assert bloom.expectedErrorRate() < 0.02
+    assert bloom.measuredErrorRate(n_samples=20000) < 0.03
+
+def testFilterKeysDropsMissingKeys():
+    bloom = BloomFilter.forCapacity(10, 0.001)
+    bloom.addHashes([blockKeyHash('present:0')])
+
+    filtered = bloom.filterKeys({1: {'present:0', 'absent:0'}, 2: {'absent:1'}})
+
+    assert filtered == {1: {'present:0'}, 2: set()}
+    assert bloom.report()['dropped_keys'] == 2
+
+def testSaveAndLoad(tmp_path):
+    path = str(tmp_path / 'keys.bloom')
+
+    bloom = BloomFilter.forCapacity(100, 0.01)
+    bloom.addHashes([blockKeyHash('key:%d' % i) for i in range(100)])
+    bloom.save(path)
+
+    loaded = BloomFilter.load(path)
+
+    assert (loaded.n_bits, loaded.n_hashes, loaded.n_keys, loaded.error_rate) == \
+        (bloom.n_bits, bloom.n_hashes, bloom.n_keys, bloom.error_rate)
+    assert all('key:%d' % i in loaded for i in range(100))
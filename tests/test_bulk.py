@@ -0,0 +1,27 @@
+import pytest
+
+from geocoder.bulk import addressFrom, inputColumns, readChunks, geocodeFile
+
+def writeCSV(tmp_path, text):
+    path = tmp_path / 'input.csv'
+    path.write_text(text)
+    return str(path)
+
+def testReadChunks(tmp_path):
+    path = writeCSV(tmp_path, 'address\n1\n2\n3\n')
+
+    chunks = list(readChunks(path, 2))
+
+    assert [[row['address'] for row in chunk] for chunk in chunks] == [['1', '2'], ['3']]
+    assert inputColumns(path) == ['address']
+
+def testAddressFrom():
+    row = {'street': '1 N Ogden Ave', 'city': '', 'zip': 60607}
+
+    assert addressFrom(row, ['street', 'city', 'zip']) == '1 N Ogden Ave 60607'
+
+def testRefusesInputWithMatchColumns(tmp_path):
+    path = writeCSV(tmp_path, 'address,match_id\n1 n ogden ave,7\n')
+
+    with pytest.raises(ValueError):
+        geocodeFile(path, str(tmp_path / 'output.csv'), ['address'], {}, None)
@@ -0,0 +1,83 @@
+import sqlalchemy as sa
+
+from geocoder.mapped_store import MappedStore, exportMapped
+from geocoder.storage import hashedBlockKey
+
+ADDRESSES = [(1, '1 N OGDEN AVE', 41.88, -87.66),
+             (2, '2 N OGDEN AVE', None, None),
+             (5, '5 N OGDEN AVE', 41.89, -87.65)]
+
+def buildEngine(path, hashed=False):
+    engine = sa.create_engine('sqlite:///%s' % path)
+
+    engine.execute('''
+        CREATE TABLE cook_county_addresses (
+            id INTEGER,
+            complete_address TEXT,
+            address_id TEXT,
+            complete_street_address TEXT,
+            usps_place_name TEXT,
+            usps_state TEXT,
+            zipcode TEXT,
+            latitude FLOAT,
+            longitude FLOAT
+        )''')
+
+    for id, address, latitude, longitude in ADDRESSES:
+        engine.execute('INSERT INTO cook_county_addresses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (id, address, str(id), address, 'CHICAGO', 'IL', '60607',
+                        latitude, longitude))
+
+    engine.execute('CREATE TABLE match_blocks (block_key {0}, id INTEGER)'\
+                   .format('BIGINT' if hashed else 'TEXT'))
+
+    # 99 is no longer in cook_county_addresses
+    blocks = [('ogden:0', 1), ('ogden:0', 2), ('ogden:0', 5),
+              ('1:1', 1), ('2:1', 2), ('2:1', 99)]
+    for block_key, id in blocks:
+        engine.execute('INSERT INTO match_blocks VALUES (?, ?)',
+                       (hashedBlockKey(block_key) if hashed else block_key, id))
+
+    engine.execute('CREATE TABLE exact_match_addresses (address_key TEXT, id INTEGER)')
+    engine.execute("INSERT INTO exact_match_addresses VALUES ('1 n ogden ave', 1)")
+
+    return engine
+
+def testRoundTrip(tmp_path):
+    engine = buildEngine(str(tmp_path / 'geocoder.db'))
+    path = str(tmp_path / 'store.map')
+
+    exportMapped(engine, path, batch_size=2)
+
+    store = MappedStore(path, columns=('latitude', 'longitude', 'pin'))
+
+    assert store.columns == ('id', 'complete_address', 'latitude', 'longitude')
+
+    records = store.records([5, 2, 3])
+    assert sorted(records) == [2, 5]
+    assert dict(records[5]) == {'id': 5,
+                                'complete_address': '5 N OGDEN AVE',
+                                'latitude': 41.89,
+                                'longitude': -87.65}
+    assert records[2]['latitude'] is None
+
+    blocked = sorted((key, id) for key, id, _ in store.blockedRecords(['ogden:0', '2:1', 'x:0']))
+    assert blocked == [('2:1', 2), ('ogden:0', 1), ('ogden:0', 2), ('ogden:0', 5)]
+
+    oversized = store.oversizedBlocks(2)
+    assert 'ogden:0' in oversized
+    assert '1:1' not in oversized
+    assert oversized.get('ogden:0') == 3
+
+    assert store.exactMatchIds(['1 n ogden ave', '2 n ogden ave']) == \
+        {'1 n ogden ave': {1}}
+
+def testHashedBlockKeys(tmp_path):
+    engine = buildEngine(str(tmp_path / 'geocoder.db'), hashed=True)
+    path = str(tmp_path / 'store.map')
+
+    exportMapped(engine, path)
+
+    store = MappedStore(path)
+
+    assert sorted(id for _, id, _ in store.blockedRecords(['ogden:0'])) == [1, 2, 5]
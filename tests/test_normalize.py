@@ -0,0 +1,58 @@
+from geocoder.normalize import preProcess, normalizeAddress, partitionKey, \
+    placePrefixes, addressVariants
+
+PARTITIONS = {'zip:60614',
+              'place:chicago',
+              'place:chicago heights',
+              'place:south chicago heights',
+              'place:evanston'}
+
+def testPreProcess():
+    assert preProcess('  "1 N  Ogden Ave"\n') == '1 n ogden ave'
+    assert preProcess(None) == ''
+
+def testNormalizeAddress():
+    assert normalizeAddress('1 North Ogden Avenue, Chicago, Illinois') == \
+        '1 n ogden ave chicago il'
+
+def testPartitionKeyPrefersZip():
+    assert partitionKey('1 n ogden ave chicago il 60614', PARTITIONS) == 'zip:60614'
+    assert partitionKey('1 n ogden ave chicago il 60614-1234', PARTITIONS) == 'zip:60614'
+
+def testPartitionKeyFallsBackToPlace():
+    assert partitionKey('1 n ogden ave, Chicago, IL 60999', PARTITIONS) == 'place:chicago'
+    assert partitionKey('1 main st evanston illinois', PARTITIONS) == 'place:evanston'
+
+def testPartitionKeyMatchesLongestPlace():
+    assert partitionKey('1 main st chicago heights il', PARTITIONS) == \
+        'place:chicago heights'
+    assert partitionKey('1 main st south chicago heights il', PARTITIONS) == \
+        'place:south chicago heights'
+
+def testPartitionKeyRefusesPartialPlace():
+    # 's chicago heights' may be South Chicago Heights
+    assert partitionKey('1 main st s chicago heights il', PARTITIONS) is None
+    assert partitionKey('1 main st oak park il', PARTITIONS) is None
+    assert partitionKey('chicago', PARTITIONS) is None
+
+def testPlacePrefixes():
+    assert placePrefixes(PARTITIONS) == {'chicago heights': {'south'},
+                                         'heights': {'chicago'}}
+
+def testAddressVariants():
+    row = {'complete_address': '1 N Ogden Ave, Chicago, IL 60607',
+           'complete_street_address': '1 N Ogden Ave',
+           'usps_place_name': 'Chicago',
+           'usps_state': 'IL'}
+
+    assert addressVariants(row) == {'1 n ogden ave chicago il 60607',
+                                    '1 n ogden ave',
+                                    '1 n ogden ave chicago il'}
+
+def testAddressVariantsWithoutStreet():
+    row = {'complete_address': '1 N Ogden Ave',
+           'complete_street_address': None,
+           'usps_place_name': None,
+           'usps_state': None}
+
+    assert addressVariants(row) == {'1 n ogden ave'}
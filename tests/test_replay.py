@@ -0,0 +1,38 @@
+from datetime import datetime
+
+from benchmarks.replay import logTime, readAccessLog, readAddresses, \
+    candidateBucket
+
+def testLogTimeCommonLogFormat():
+    assert logTime('10/Oct/2023:13:55:36 -0500') == datetime(2023, 10, 10, 18, 55, 36)
+
+def testLogTimeWerkzeug():
+    assert logTime('10/Oct/2023 13:55:36') == datetime(2023, 10, 10, 13, 55, 36)
+
+def testLogTimeUnknown():
+    assert logTime('2023-10-10T13:55:36') is None
+
+def testReadAccessLog():
+    lines = [
+        '127.0.0.1 - - [10/Oct/2023:13:55:36 +0000] "GET /geocode/?address=1+n+ogden+ave HTTP/1.1" 200 512\n',
+        '127.0.0.1 - - [10/Oct/2023:13:55:37 +0000] "GET /geocode/stats/ HTTP/1.1" 200 64\n',
+        '127.0.0.1 - - [10/Oct/2023:13:55:38 +0000] "POST /geocode/batch/ HTTP/1.1" 200 64\n',
+        'not a log line\n',
+        '127.0.0.1 - - [10/Oct/2023 13:55:40] "GET /geocode?address=2%20n%20ogden%20ave&debug=timings HTTP/1.1" 200 -\n',
+        '127.0.0.1 - - [10/Oct/2023:13:55:41 +0000] "GET /geocode/ HTTP/1.1" 400 64\n',
+    ]
+
+    assert list(readAccessLog(lines)) == [(0.0, '1 n ogden ave'),
+                                          (4.0, '2 n ogden ave')]
+
+def testReadAddresses():
+    lines = ['1 n ogden ave\n', '\n', '2 n ogden ave\n']
+
+    assert list(readAddresses(lines)) == [(0.0, '1 n ogden ave'),
+                                          (0.0, '2 n ogden ave')]
+    assert list(readAddresses(lines, rate=2)) == [(0.0, '1 n ogden ave'),
+                                                  (0.5, '2 n ogden ave')]
+
+def testCandidateBucket():
+    assert [candidateBucket(n) for n in (None, 0, 1, 10, 11, 1000, 1001)] == \
+        ['unknown', '0', '1-10', '1-10', '11-50', '251-1000', '>1000']
@@ -0,0 +1,107 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from geocoder.singleflight import SingleFlight, AsyncSingleFlight
+
+def runConcurrently(flight, func, n=5):
+    '''
+    Call `flight.do` from `n` threads while the leader is held in
+    `func`, returning what each call returned or raised
+    '''
+
+    release = threading.Event()
+    outcomes = []
+
+    def leader():
+        release.wait(5)
+        return func()
+
+    def call():
+        try:
+            outcomes.append(flight.do('key', leader))
+        except BaseException as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+
+    # Every thread is either leading or waiting once all calls are in
+    while flight.snapshot()['calls'] < n:
+        time.sleep(0.001)
+
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    return outcomes
+
+def testConcurrentCallsShareOneComputation():
+    flight = SingleFlight()
+    computations = []
+
+    def func():
+        computations.append(1)
+        return 'result'
+
+    outcomes = runConcurrently(flight, func)
+
+    assert outcomes == ['result'] * 5
+    assert len(computations) == 1
+    assert flight.snapshot() == {'calls': 5, 'computations': 1, 'saved': 4}
+
+def testFollowersRaiseTheLeadersException():
+    flight = SingleFlight()
+
+    def func():
+        raise ValueError('failed')
+
+    outcomes = runConcurrently(flight, func)
+
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+
+def testFollowersRaiseBaseExceptions():
+    flight = SingleFlight()
+
+    def func():
+        raise KeyboardInterrupt()
+
+    outcomes = runConcurrently(flight, func)
+
+    assert all(isinstance(outcome, KeyboardInterrupt) for outcome in outcomes)
+
+def testLaterCallsComputeAgain():
+    flight = SingleFlight()
+
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 2
+
+    with pytest.raises(ValueError):
+        flight.do('key', int, 'x')
+
+    assert flight.do('key', lambda: 3) == 3
+
+def testAsyncSingleFlight():
+    flight = AsyncSingleFlight()
+    computations = []
+
+    async def func():
+        computations.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def main():
+        return await asyncio.gather(*[flight.do('key', func) for _ in range(5)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+    assert results == ['result'] * 5
+    assert len(computations) == 1
+    assert flight.snapshot() == {'calls': 5, 'computations': 1, 'saved': 4}
@@ -0,0 +1,31 @@
+from geocoder.storage import blockKeyHash, hashedBlockKey, HashedKeys, \
+    queryKeys, projection
+
+def testBlockKeyHashIsStable():
+    assert blockKeyHash('1 n ogden ave:0') == blockKeyHash('1 n ogden ave:0')
+    assert blockKeyHash('a:0') != blockKeyHash('a:1')
+    assert 0 <= blockKeyHash('a:0') < 1 << 64
+
+def testHashedBlockKeyFitsBigint():
+    for key in ('a:%d' % i for i in range(1000)):
+        hashed = hashedBlockKey(key)
+        assert -(1 << 63) <= hashed < 1 << 63
+        assert hashed % (1 << 64) == blockKeyHash(key)
+
+def testHashedKeys():
+    keys = HashedKeys({blockKeyHash('a:0'): 10})
+
+    assert 'a:0' in keys
+    assert 'b:0' not in keys
+    assert keys.get('a:0') == 10
+    assert keys.get('b:0', 0) == 0
+    assert len(keys) == 1
+    assert not HashedKeys({})
+
+def testQueryKeys():
+    assert queryKeys(['a:0', 'b:1'], False) == {'a:0': 'a:0', 'b:1': 'b:1'}
+    assert queryKeys(['a:0'], True) == {hashedBlockKey('a:0'): 'a:0'}
+
+def testProjection():
+    assert projection(['latitude', 'id']) == ('id', 'complete_address', 'latitude')
+    assert projection() == ('id', 'complete_address')
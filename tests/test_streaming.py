@@ -0,0 +1,79 @@
+import csv
+import io
+import json
+
+from geocoder.streaming import decodeLines, readNDJSON, readCSV, \
+    microBatches, ndjsonLine, CSVWriter, CSV_MATCH_COLUMNS
+
+def testDecodeLines():
+    assert list(decodeLines([b'a\n', 'b\n'])) == ['a\n', 'b\n']
+
+def testReadNDJSON():
+    lines = ['{"address": "1 n ogden ave", "id": 1}\n',
+             '\n',
+             '"2 n ogden ave"\n',
+             'not json\n',
+             '{"id": 3}\n']
+
+    assert list(readNDJSON(lines)) == [
+        ({'address': '1 n ogden ave', 'id': 1}, '1 n ogden ave', None),
+        ({'address': '2 n ogden ave'}, '2 n ogden ave', None),
+        (None, None, 'line is not valid JSON'),
+        ({'id': 3}, None, 'address is required'),
+    ]
+
+def testReadNDJSONColumn():
+    rows = list(readNDJSON(['{"street": "1 n ogden ave"}'], column='street'))
+
+    assert rows == [({'street': '1 n ogden ave'}, '1 n ogden ave', None)]
+
+def testReadCSV():
+    lines = ['id,address\n', '1,1 n ogden ave\n', '2,\n']
+
+    rows = list(readCSV(lines))
+
+    assert [(dict(row), address, error) for row, address, error in rows] == [
+        ({'id': '1', 'address': '1 n ogden ave'}, '1 n ogden ave', None),
+        ({'id': '2', 'address': ''}, None, 'address is required'),
+    ]
+
+def testReadCSVWithoutColumn():
+    assert list(readCSV(['id,street\n', '1,x\n'])) == \
+        [(None, None, 'the CSV header has no address column')]
+
+def testMicroBatchesDouble():
+    batches = list(microBatches(range(20), 8))
+
+    assert [len(batch) for batch in batches] == [1, 2, 4, 8, 5]
+    assert [row for batch in batches for row in batch] == list(range(20))
+
+def testNdjsonLine():
+    line = ndjsonLine({'address': 'x'}, [{'id': 1}], True, None)
+    assert json.loads(line) == {'input': {'address': 'x'},
+                                'matches': [{'id': 1}],
+                                'fast_path': True}
+
+    line = ndjsonLine(None, [], False, 'line is not valid JSON')
+    assert json.loads(line) == {'input': None, 'error': 'line is not valid JSON'}
+
+def testCSVWriterKeepsInputColumns():
+    writer = CSVWriter()
+
+    row = {'address': '1 n ogden ave', 'latitude': '41.9', 'longitude': '-87.6'}
+    match = {'id': 7,
+             'complete_address': '1 N OGDEN AVE',
+             'latitude': 41.88,
+             'longitude': -87.66,
+             'confidence': 0.9}
+
+    output = writer.line(row, [match], False, None)
+    output += writer.line({'address': ''}, [], False, 'address is required')
+
+    rows = list(csv.reader(io.StringIO(output)))
+
+    assert rows[0] == ['address', 'latitude', 'longitude'] \
+        + list(CSV_MATCH_COLUMNS) + ['match_error']
+    assert rows[1] == ['1 n ogden ave', '41.9', '-87.6',
+                       '7', '1 N OGDEN AVE', '41.88', '-87.66', '0.9', 'False', '']
+    assert rows[2][-1] == 'address is required'
+    assert len(set(rows[0])) == len(rows[0])